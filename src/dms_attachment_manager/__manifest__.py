@@ -7,8 +7,11 @@
     "license": "SEL-1",
     "depends": ["base", "dms"],
     "data": [
+        "data/ir_cron_data.xml",
         "views/attachment_export_views.xml",
         "wizards/attachment_export_wizard_views.xml",
+        "views/attachment_download_views.xml",
+        "views/attachment_export_profile_views.xml",
         "views/menu_views.xml"
     ],
     "installable": True,
@@ -0,0 +1,261 @@
+"""Benchmark the export and download paths on a synthetic corpus.
+
+Runs against an existing database that has the module installed::
+
+    python bench_export.py -c odoo.conf -d bench --count 10000 \\
+        --size lognormal:20000 --mimetypes text/plain=5,image/jpeg=3 \\
+        --duplicates 0.1 --output results.json
+
+Every stage reports wall time, SQL query count, the peak RSS reached during
+the stage and, where an archive is produced, its size. The peak is reset
+before each stage through ``/proc/self/clear_refs``; where that is not
+available, the peak of the whole process so far is reported instead. The
+whole run is one transaction that is rolled back at the end, so the corpus
+does not stay in the database; the files it wrote to the filestore are
+removed by the filestore garbage collection.
+"""
+import argparse
+import base64
+import bisect
+import json
+import random
+import resource
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import odoo
+from odoo import SUPERUSER_ID, api
+
+RES_MODEL = "res.country"
+DUPLICATE_POOL_SIZE = 100
+WORDS = [
+    b"invoice", b"order", b"delivery", b"customer", b"amount", b"date",
+    b"total", b"tax", b"product", b"quantity", b"price", b"address",
+]
+EXTENSIONS = {
+    "text/plain": "txt",
+    "text/csv": "csv",
+    "application/pdf": "pdf",
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "application/zip": "zip",
+}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-c", "--config", help="Odoo configuration file")
+    parser.add_argument("-d", "--database", required=True)
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument(
+        "--size",
+        default="lognormal:20000",
+        help="fixed:<bytes>, uniform:<min>-<max> or lognormal:<median>",
+    )
+    parser.add_argument(
+        "--mimetypes",
+        default="text/plain=5,application/pdf=3,image/jpeg=2",
+        help="comma separated mimetype=weight pairs",
+    )
+    parser.add_argument(
+        "--duplicates", type=float, default=0.0, help="share of repeated contents"
+    )
+    parser.add_argument(
+        "--format", default="zip", choices=["zip", "tar_gz", "tar_zst"]
+    )
+    parser.add_argument("--deduplicate", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def size_sampler(spec, rnd):
+    kind, __, value = spec.partition(":")
+    if kind == "fixed":
+        return lambda: int(value)
+    if kind == "uniform":
+        low, high = (int(bound) for bound in value.split("-"))
+        return lambda: rnd.randint(low, high)
+    if kind == "lognormal":
+        median = float(value)
+        return lambda: max(1, int(rnd.lognormvariate(0, 1) * median))
+    raise ValueError("Unknown size distribution: {}".format(spec))
+
+
+def mimetype_sampler(spec, rnd):
+    mimetypes, cumulative, total = [], [], 0.0
+    for pair in spec.split(","):
+        mimetype, __, weight = pair.partition("=")
+        total += float(weight or 1)
+        mimetypes.append(mimetype)
+        cumulative.append(total)
+    return lambda: mimetypes[bisect.bisect(cumulative, rnd.random() * total)]
+
+
+def make_content(mimetype, size, rnd):
+    if mimetype.startswith("text/"):
+        # compressible like real text documents
+        words = []
+        length = 0
+        while length < size:
+            word = rnd.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return b" ".join(words)[:size]
+    # already compressed formats look random to deflate
+    return rnd.getrandbits(size * 8).to_bytes(size, "little")
+
+
+def generate_corpus(env, args):
+    rnd = random.Random(args.seed)
+    next_size = size_sampler(args.size, rnd)
+    next_mimetype = mimetype_sampler(args.mimetypes, rnd)
+    # duplicates are drawn from a bounded pool of earlier contents
+    contents = []
+    attachment_ids = []
+    for index in range(args.count):
+        mimetype = next_mimetype()
+        if contents and rnd.random() < args.duplicates:
+            datas = rnd.choice(contents)
+        else:
+            datas = base64.b64encode(
+                make_content(mimetype, next_size(), rnd)
+            ).decode("ascii")
+            if len(contents) < DUPLICATE_POOL_SIZE:
+                contents.append(datas)
+            else:
+                contents[rnd.randrange(DUPLICATE_POOL_SIZE)] = datas
+        name = "bench_{:06d}.{}".format(index, EXTENSIONS.get(mimetype, "bin"))
+        attachment = env["ir.attachment"].create(
+            {
+                "name": name,
+                "datas_fname": name,
+                "datas": datas,
+                "mimetype": mimetype,
+                "res_model": RES_MODEL,
+                "res_id": index + 1,
+            }
+        )
+        attachment_ids.append(attachment.id)
+    return env["ir.attachment"].browse(attachment_ids)
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of the process, return False if not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def read_peak_rss_kb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    # ru_maxrss is never reset, it is the peak of the whole process
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(results, env, stage, function):
+    cr = env.cr
+    peak_reset = reset_peak_rss()
+    queries = cr.sql_log_count
+    start = time.perf_counter()
+    value = function()
+    env.invalidate_all()
+    results.append(
+        {
+            "stage": stage,
+            "seconds": round(time.perf_counter() - start, 3),
+            "queries": cr.sql_log_count - queries,
+            "peak_rss_kb": read_peak_rss_kb(),
+            "peak_rss_per_stage": peak_reset,
+        }
+    )
+    return value, results[-1]
+
+
+def run(env, args):
+    # only importable once the registry has loaded the addons
+    from odoo.addons.dms_attachment_manager.controllers import attachment_controller
+
+    results = []
+    attachments, __ = measure(
+        results, env, "generate", lambda: generate_corpus(env, args)
+    )
+
+    model = env["ir.model"].search([("model", "=", RES_MODEL)], limit=1)
+    export = env["ir.attachment.export"].create(
+        {
+            "start_date": date.today() - timedelta(days=1),
+            "end_date": date.today() + timedelta(days=1),
+            "model_ids": [(6, 0, model.ids)],
+            "archive_format": args.format,
+            "deduplicate": args.deduplicate,
+        }
+    )
+    measure(results, env, "check", export.action_check_attachments)
+
+    __, stage = measure(results, env, "pack", export.pack_zip)
+    # file_size of archives from 2 GiB on is empty
+    stage["archive_bytes"] = int(
+        sum(
+            export.stage_ids.filtered(lambda x: x.name == "store").mapped(
+                "bytes_written"
+            )
+        )
+    )
+
+    controller = attachment_controller.AttachmentDownloadController()
+    download_bytes, stage = measure(
+        results,
+        env,
+        "download",
+        lambda: sum(
+            len(data)
+            for data in controller._iter_zip_stream(
+                env, attachments.ids, args.format
+            )
+        ),
+    )
+    stage["archive_bytes"] = download_bytes
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    config_args = ["-d", args.database]
+    if args.config:
+        config_args += ["-c", args.config]
+    odoo.tools.config.parse_config(config_args)
+
+    # keeps the progress commits of the packer out of the run, so
+    # everything can be rolled back at the end
+    threading.currentThread().testing = True
+    with api.Environment.manage():
+        with odoo.registry(args.database).cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            try:
+                results = run(env, args)
+            finally:
+                cr.rollback()
+
+    report = {"parameters": vars(args), "stages": results}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
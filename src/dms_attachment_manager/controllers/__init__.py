@@ -0,0 +1 @@
+from . import attachment_controller
\ No newline at end of file
@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from werkzeug.http import parse_range_header
+
+from odoo import _, api, http, registry
+from odoo.exceptions import AccessError
+from odoo.http import content_disposition, request
+
+from ..models.ir_attachment_export import MANIFEST_ENTRY_NAME
+from ..tools.archive_cache import ArchiveCache
+from ..tools.archive_writer import (
+    ARCHIVE_EXTENSIONS,
+    ARCHIVE_MIMETYPES,
+    new_archive_writer,
+)
+from ..tools.name_allocator import UniqueNameAllocator
+from ..tools.zip_stream import COPY_CHUNK_SIZE, DEFAULT_LEVEL, StreamBuffer
+
+SKIPPED_ENTRY_NAME = "_skipped.csv"
+# read in one query before packing instead of once per attachment
+PREFETCH_FIELDS = [
+    "name",
+    "type",
+    "datas_fname",
+    "mimetype",
+    "store_fname",
+    "file_size",
+    "checksum",
+    "write_date",
+    "res_model",
+    "res_id",
+]
+# changes whenever the archive layout or the cache key changes, so old cache
+# entries are unused
+CACHE_VERSION = 4
+
+
+class AttachmentDownloadController(http.Controller):
+    @http.route("/web/attachment/download_zip", type="http", auth="user")
+    def download_zip(self, ids=None, **kwargs):
+        if not ids:
+            return request.not_found()
+
+        # missing, unreadable and URL attachments are listed as skipped in
+        # the archive, reading them here would fail the whole request
+        attachment_ids = map(int, ids.split(","))
+        attachments = request.env["ir.attachment"].browse(attachment_ids)
+        return self._create_zip(attachments)
+
+    @http.route(
+        "/web/attachment/download_zip/<string:token>", type="http", auth="user"
+    )
+    def download_zip_session(self, token, **kwargs):
+        download = request.env["attachment.download"].search(
+            [("token", "=", token)], limit=1
+        )
+        if not download:
+            return request.not_found()
+
+        attachments = download._get_downloadable_attachments()
+        if not attachments:
+            return request.not_found()
+
+        return self._create_zip(attachments, download.name, download.archive_format)
+
+    def _create_zip(self, attachments, filename=None, archive_format="zip"):
+        if not filename:
+            current_time = datetime.now()
+            filename = (
+                _("Attachments ")
+                + current_time.strftime("%d.%m.%Y %H:%M")
+                + ARCHIVE_EXTENSIONS[archive_format]
+            )
+
+        headers = [
+            ("Content-Type", ARCHIVE_MIMETYPES[archive_format]),
+            ("Content-Disposition", content_disposition(filename)),
+        ]
+        # sorted, so the same selection always gives the same archive
+        attachment_ids = sorted(attachments.ids)
+        cache_key = None
+        archive_cache = self._get_archive_cache(request.env)
+        if archive_cache:
+            cache_key = self._get_cache_key(
+                request.env, attachment_ids, archive_format
+            )
+            headers.append(("ETag", '"{}"'.format(cache_key)))
+            cached_file = archive_cache.get(cache_key)
+            if cached_file:
+                if self._can_read_all(attachments):
+                    return self._send_cached_archive(cached_file, cache_key, headers)
+                cached_file.close()
+
+        stream = self._stream_zip(
+            request.env.cr.dbname,
+            request.env.uid,
+            attachment_ids,
+            archive_format,
+            cache_key,
+        )
+        return request.make_response(stream, headers=headers)
+
+    def _stream_zip(
+        self, dbname, uid, attachment_ids, archive_format="zip", cache_key=None
+    ):
+        """Generate the archive while the attachments are being read.
+
+        The response body is consumed after the request cursor is closed, so
+        the generator works on a cursor of its own. With a ``cache_key`` the
+        archive is also written to the archive cache.
+        """
+        with api.Environment.manage(), registry(dbname).cursor() as cr:
+            env = api.Environment(cr, uid, {})
+            stream = self._iter_zip_stream(env, attachment_ids, archive_format)
+            cache_file = None
+            if cache_key:
+                cache_file = self._get_archive_cache(env).open(cache_key)
+            try:
+                for data in stream:
+                    if cache_file:
+                        cache_file.write(data)
+                    yield data
+                if cache_file:
+                    cache_file.commit()
+            except GeneratorExit:
+                # the client went away; the archive is finished anyway, so
+                # the retry after a failed download is served from the cache.
+                # This has to happen here, while the cursor is still open.
+                if cache_file:
+                    for data in stream:
+                        cache_file.write(data)
+                    cache_file.commit()
+                raise
+            finally:
+                # closed here and not when garbage collected, which may be
+                # after the cursor is closed
+                stream.close()
+                if cache_file:
+                    cache_file.discard()
+
+    def _get_archive_cache(self, env):
+        max_size = env["ir.attachment.export"]._get_param("download_cache_size", 0)
+        if max_size <= 0:
+            return None
+        return ArchiveCache(
+            os.path.join(env["ir.attachment"]._filestore(), "dms_download_cache"),
+            max_size * 1024 * 1024,
+        )
+
+    def _get_cache_key(self, env, attachment_ids, archive_format):
+        """Return the cache key of the archive of ``attachment_ids``.
+
+        The key covers the requested ids, the id, checksum, write date and
+        name of the existing attachments, the user and the writer settings,
+        so any change to a member leads to a new key. The attachments are
+        aggregated in one query, the response starts without reading them.
+        Access rights are checked on use, see :meth:`_can_read_all`.
+        """
+        digest = hashlib.sha1()
+        settings = [CACHE_VERSION, archive_format, "auto", DEFAULT_LEVEL, env.uid]
+        digest.update(json.dumps(settings).encode("utf-8"))
+        digest.update(",".join(map(str, attachment_ids)).encode("ascii"))
+        env.cr.execute(
+            """
+            SELECT md5(string_agg(
+                md5(concat_ws(':', id, checksum, write_date, name)), ''
+                ORDER BY id
+            ))
+            FROM ir_attachment
+            WHERE id = ANY(%s)
+            """,
+            (list(attachment_ids),),
+        )
+        digest.update((env.cr.fetchone()[0] or "").encode("ascii"))
+        return digest.hexdigest()
+
+    def _can_read_all(self, attachments):
+        """Return whether the user may read all existing ``attachments``.
+
+        A cached archive is only served then; otherwise the archive is
+        streamed again, leaving out what the user may no longer read.
+        """
+        try:
+            attachments.check("read")
+        except AccessError:
+            return False
+        return True
+
+    def _send_cached_archive(self, archive_file, cache_key, headers):
+        """Send a cached archive, or the byte range asked for to resume."""
+        size = os.fstat(archive_file.fileno()).st_size
+        start, stop = 0, size
+        status = 200
+        httprequest = request.httprequest
+        byte_range = parse_range_header(httprequest.headers.get("Range"))
+        span = byte_range and byte_range.range_for_length(size)
+        if_range = httprequest.headers.get("If-Range")
+        if span and (not if_range or if_range.strip('"') == cache_key):
+            start, stop = span
+            status = 206
+            headers.append(
+                ("Content-Range", "bytes {}-{}/{}".format(start, stop - 1, size))
+            )
+        headers += [
+            ("Accept-Ranges", "bytes"),
+            ("Content-Length", str(stop - start)),
+        ]
+        response = request.make_response(
+            self._iter_file_range(archive_file, start, stop), headers=headers
+        )
+        response.status_code = status
+        return response
+
+    def _iter_file_range(self, archive_file, start, stop):
+        with archive_file:
+            archive_file.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                data = archive_file.read(min(COPY_CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+    def _iter_zip_stream(self, env, attachment_ids, archive_format="zip"):
+        """Yield the archive of ``attachment_ids`` in pieces, using ``env``."""
+        export_model = env["ir.attachment.export"]
+        buffer = StreamBuffer()
+        zip_writer = new_archive_writer(
+            archive_format, buffer, threads=export_model._get_param("pack_workers", 1)
+        )
+        skipped = []
+        manifest = []
+        named_attachments = self._iter_named_attachments(
+            env["ir.attachment"].browse(attachment_ids), skipped, manifest
+        )
+        # TAR archives are compressed as one stream, not entry by entry
+        executor = archive_format == "zip" and export_model._get_pack_executor()
+        try:
+            for __ in export_model._iter_zip_entries(
+                zip_writer, named_attachments, executor
+            ):
+                data = buffer.drain()
+                if data:
+                    yield data
+        finally:
+            if executor:
+                executor.shutdown()
+
+        if skipped:
+            export_model._write_csv_entry(
+                zip_writer,
+                SKIPPED_ENTRY_NAME,
+                ["attachment_id", "reason"],
+                skipped,
+            )
+        export_model._write_manifest_entry(zip_writer, manifest)
+        zip_writer.close()
+        yield buffer.drain()
+
+    def _get_readable_attachments(self, attachments):
+        """Return the readable attachments and the skipped ones.
+
+        Existence and access rights are checked for the whole batch at once
+        and the fields needed for packing are prefetched, so the number of
+        queries does not grow with the number of files. Skipped files, URL
+        attachments included, are returned as ``(attachment_id, reason)``
+        rows.
+        """
+        existing = attachments.exists()
+        allowed, denied = existing._split_by_access("read")
+        allowed.read(PREFETCH_FIELDS)
+        links = allowed.filtered(lambda x: x.type != "binary")
+        allowed -= links
+        existing_ids = set(existing.ids)
+        skipped = [
+            (attachment_id, "missing")
+            for attachment_id in attachments.ids
+            if attachment_id not in existing_ids
+        ]
+        skipped.extend(
+            (attachment_id, "access denied") for attachment_id in denied.ids
+        )
+        skipped.extend((attachment_id, "not a file") for attachment_id in links.ids)
+        return allowed, skipped
+
+    def _iter_named_attachments(self, attachments, skipped, manifest):
+        """Yield ``(name, attachment)`` for the readable ``attachments``.
+
+        Works batch by batch with only one batch in the cache; the skipped
+        attachments are added to ``skipped`` and the named ones to
+        ``manifest``.
+        """
+        batch_size = attachments.env["ir.attachment.export"]._get_param(
+            "export_batch_size", 500
+        )
+        name_allocator = UniqueNameAllocator(
+            [SKIPPED_ENTRY_NAME, MANIFEST_ENTRY_NAME]
+        )
+        for batch in attachments._iter_batches(batch_size):
+            readable, batch_skipped = self._get_readable_attachments(batch)
+            skipped.extend(batch_skipped)
+            for attachment in readable:
+                file_name = name_allocator.allocate(attachment.name)
+                manifest.append(
+                    (
+                        attachment.id,
+                        attachment.res_model,
+                        attachment.res_id,
+                        file_name,
+                        attachment.checksum,
+                    )
+                )
+                yield file_name, attachment
@@ -1 +1,3 @@
-from . import ir_attachment, ir_attachment_export
\ No newline at end of file
+from . import ir_attachment, ir_attachment_export, ir_attachment_export_part
+from . import ir_attachment_export_profile, ir_attachment_download
+from . import ir_attachment_export_stage, ir_attachment_model_stat
\ No newline at end of file
@@ -1,7 +1,261 @@
-from odoo import fields, models
+import base64
+import hashlib
+import os
+import shutil
+
+from psycopg2.extensions import TransactionRollbackError
+
+from odoo import api, fields, models
+from odoo.exceptions import AccessError
+from odoo.tools.sql import column_exists, create_column
+
+CHUNK_SIZE = 1024 * 1024
+# file_size is an int4 column
+MAX_FILE_SIZE = 2 ** 31 - 1
+
+
+def iter_raw_source(full_path, raw_data, chunk_size=CHUNK_SIZE):
+    """Yield chunks of a source returned by ``_get_raw_source``.
+
+    Does not touch the ORM, so it can run in worker threads.
+    """
+    if full_path:
+        with open(full_path, "rb") as raw_file:
+            for chunk in iter(lambda: raw_file.read(chunk_size), b""):
+                yield chunk
+        return
+    for start in range(0, len(raw_data or b""), chunk_size):
+        yield raw_data[start:start + chunk_size]
 
 
 class IrAttachment(models.Model):
     _inherit = "ir.attachment"
 
     is_exported = fields.Boolean(string="Exported", default=False)
+    export_claim_id = fields.Many2one(
+        comodel_name="ir.attachment.export",
+        string="Claimed by Export",
+        index=True,
+        readonly=True,
+        copy=False,
+        ondelete="set null",
+    )
+    file_extension = fields.Char(
+        string="File Extension",
+        index=True,
+        readonly=True,
+        compute="_compute_file_extension",
+        store=True,
+    )
+
+    def _auto_init(self):
+        # fill the new column in one statement instead of letting the ORM
+        # recompute it record by record on large attachment tables
+        if not column_exists(self.env.cr, self._table, "file_extension"):
+            create_column(self.env.cr, self._table, "file_extension", "varchar")
+            self.env.cr.execute(
+                """
+                UPDATE ir_attachment
+                SET file_extension = NULLIF(
+                    lower(substring(name from '\\.([^.]*)$')), ''
+                )
+                """
+            )
+        return super(IrAttachment, self)._auto_init()
+
+    def init(self):
+        # export candidates are searched by flag, model and creation date
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS ir_attachment_export_candidate_idx
+            ON ir_attachment (is_exported, res_model, create_date)
+            """
+        )
+
+    @api.depends("name")
+    def _compute_file_extension(self):
+        for attachment in self:
+            name = attachment.name or ""
+            extension = name.rsplit(".", 1)[1].lower() if "." in name else ""
+            attachment.file_extension = extension or False
+
+    def _claim_for_export(self, export_id):
+        """Flag the attachments as exported by ``export_id``.
+
+        Returns the attachments actually claimed. Rows locked by a concurrent
+        claim are skipped instead of waited for, and rows claimed by a
+        transaction that committed after this one started are left out
+        instead of failing the whole transaction, so parallel exports split
+        the candidates without overlap or retries.
+        """
+        if not self:
+            return self
+        self.check("write")
+        batch_size = self.env["ir.attachment.export"]._get_param(
+            "flag_batch_size", 5000
+        )
+        ids = self.ids
+        claimed_ids = []
+        for start in range(0, len(ids), batch_size):
+            batch = self.browse(ids[start:start + batch_size])
+            claimed_ids.extend(batch._claim_ids(export_id))
+        self.invalidate_cache(["is_exported", "export_claim_id"], ids)
+        return self.browse(claimed_ids)
+
+    def _claim_ids(self, export_id):
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute(
+                    """
+                    UPDATE ir_attachment
+                    SET is_exported = true, export_claim_id = %s
+                    WHERE id IN (
+                        SELECT id FROM ir_attachment
+                        WHERE id IN %s AND is_exported IS NOT TRUE
+                        ORDER BY id
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id
+                    """,
+                    (export_id, tuple(self.ids)),
+                    log_exceptions=False,
+                )
+                return [row[0] for row in self.env.cr.fetchall()]
+        except TransactionRollbackError:
+            # some rows were claimed and committed after our snapshot was
+            # taken; narrow the batch down to leave only those out
+            if len(self) == 1:
+                return []
+            middle = len(self) // 2
+            return self[:middle]._claim_ids(export_id) + self[middle:]._claim_ids(
+                export_id
+            )
+
+    def _release_export_claims(self, export_ids):
+        """Reset ``is_exported`` of the attachments claimed by ``export_ids``.
+
+        Attachments claimed by another export keep their flag. Attachments
+        flagged before claims were recorded have no owner and are reset too.
+        """
+        if not self:
+            return
+        self.check("write")
+        batch_size = self.env["ir.attachment.export"]._get_param(
+            "flag_batch_size", 5000
+        )
+        ids = self.ids
+        for start in range(0, len(ids), batch_size):
+            self.env.cr.execute(
+                """
+                UPDATE ir_attachment
+                SET is_exported = false, export_claim_id = NULL
+                WHERE id IN %s
+                AND (export_claim_id IS NULL OR export_claim_id IN %s)
+                """,
+                (tuple(ids[start:start + batch_size]), tuple(export_ids)),
+            )
+        self.invalidate_cache(["is_exported", "export_claim_id"], ids)
+
+    def _split_by_access(self, mode="read"):
+        """Return ``(allowed, denied)`` recordsets for ``mode``.
+
+        The whole recordset is checked at once and only split in halves when
+        that fails, so k denied attachments cost O(k log n) checks instead of
+        one check per attachment.
+        """
+        try:
+            self.check(mode)
+        except AccessError:
+            if len(self) == 1:
+                return self.browse(), self
+            middle = len(self) // 2
+            allowed_first, denied_first = self[:middle]._split_by_access(mode)
+            allowed_last, denied_last = self[middle:]._split_by_access(mode)
+            return allowed_first + allowed_last, denied_first + denied_last
+        return self, self.browse()
+
+    def _iter_batches(self, batch_size):
+        """Yield the recordset in batches of ``batch_size`` records.
+
+        The cache of a batch is dropped once the next batch is requested, so
+        memory is bounded by the batch size instead of the recordset size.
+        """
+        ids = self.ids
+        for start in range(0, len(ids), batch_size):
+            batch = self.browse(ids[start:start + batch_size])
+            yield batch
+            batch.invalidate_cache(ids=batch.ids)
+
+    def _get_raw_source(self):
+        """Return ``(full_path, raw_data)`` for the attachment content.
+
+        ``full_path`` is set for attachments stored in the filestore,
+        otherwise ``raw_data`` holds the decoded ``db_datas``.
+        """
+        self.ensure_one()
+        full_path = self.store_fname and self._full_path(self.store_fname)
+        if full_path and os.path.isfile(full_path):
+            return full_path, None
+        if self.db_datas:
+            return None, base64.b64decode(self.db_datas)
+        return None, b""
+
+    def _iter_raw_chunks(self, chunk_size=CHUNK_SIZE):
+        """Yield the raw content of the attachment in chunks.
+
+        Filestore files are read directly instead of going through the base64
+        encoded ``datas`` field.
+        ``db_datas`` is only decoded for attachments without a stored file.
+        """
+        full_path, raw_data = self._get_raw_source()
+        return iter_raw_source(full_path, raw_data, chunk_size)
+
+    @api.model
+    def _create_from_file(self, path, vals, checksum=None):
+        """Create an attachment whose content is the file at ``path``.
+
+        With filestore storage the file is moved into place and ``store_fname``,
+        ``file_size`` and ``checksum`` are set directly, so the content is never
+        loaded into memory or base64 encoded. Pass the SHA-1 ``checksum`` when
+        it was computed while writing the file, otherwise the file is read
+        once to compute it. The file at ``path`` is consumed.
+
+        ``file_size`` is left empty for files that do not fit its integer
+        column, i.e. from 2 GiB on.
+        """
+        if self._storage() != "file":
+            with open(path, "rb") as source_file:
+                vals = dict(vals, datas=base64.b64encode(source_file.read()))
+            os.unlink(path)
+            return self.create(vals)
+
+        if not checksum:
+            sha1 = hashlib.sha1()
+            with open(path, "rb") as source_file:
+                for chunk in iter(lambda: source_file.read(CHUNK_SIZE), b""):
+                    sha1.update(chunk)
+            checksum = sha1.hexdigest()
+        file_size = os.path.getsize(path)
+        if file_size > MAX_FILE_SIZE:
+            file_size = None
+
+        store_fname = "{}/{}".format(checksum[:2], checksum)
+        full_path = self._full_path(store_fname)
+        if os.path.isfile(full_path):
+            os.unlink(path)
+        else:
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            shutil.move(path, full_path)
+        # like _file_write, so the file is collected if the transaction
+        # creating the attachment rolls back
+        self._mark_for_gc(store_fname)
+
+        attachment = self.create(dict(vals, store_fname=store_fname))
+        # file_size and checksum are dropped by create/write
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET file_size = %s, checksum = %s WHERE id = %s",
+            (file_size, checksum, attachment.id),
+        )
+        attachment.invalidate_cache(["file_size", "checksum"], attachment.ids)
+        return attachment
@@ -0,0 +1,113 @@
+import uuid
+from datetime import datetime
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+from odoo.tools.safe_eval import safe_eval
+
+from ..tools.archive_writer import ARCHIVE_EXTENSIONS, ARCHIVE_FORMATS
+from ..tools.name_allocator import UniqueNameAllocator, split_extension
+
+
+class IrAttachmentDownload(models.TransientModel):
+    """Selection of attachments to download as one archive.
+
+    The selection stays on the server and the download URL only carries the
+    token, so selections of any size fit into the URL. Transient records are
+    only visible to their creator and are vacuumed automatically.
+    """
+
+    _name = "attachment.download"
+    _description = "Attachment Download"
+
+    name = fields.Char(
+        string="File Name",
+        required=True,
+        default=lambda self: self._default_name(),
+    )
+    token = fields.Char(
+        string="Token",
+        required=True,
+        readonly=True,
+        index=True,
+        copy=False,
+        default=lambda self: uuid.uuid4().hex,
+    )
+    attachment_ids = fields.Many2many(
+        "ir.attachment",
+        "attachment_download_ir_attachment_rel",
+        "download_id",
+        "attachment_id",
+        string="Attachments",
+    )
+    archive_format = fields.Selection(
+        ARCHIVE_FORMATS, string="Archive Format", default="zip", required=True
+    )
+    domain = fields.Text(
+        string="Domain",
+        help="Resolved when the archive is downloaded, used instead of the "
+        "attachments for selections that are too large to list.",
+    )
+
+    _sql_constraints = [
+        ("token_unique", "unique(token)", "The download token must be unique.")
+    ]
+
+    @api.model
+    def _default_name(self, archive_format="zip"):
+        current_time = datetime.now()
+        return (
+            _("Attachments ")
+            + current_time.strftime("%d.%m.%Y %H:%M")
+            + ARCHIVE_EXTENSIONS[archive_format]
+        )
+
+    def prepare_attachment(self):
+        archive_format = self.env.context.get("archive_format", "zip")
+        values = {
+            "archive_format": archive_format,
+            "name": self._default_name(archive_format),
+        }
+        active_domain = self.env.context.get("active_domain")
+        if self.env.context.get("download_all_results") and active_domain:
+            # the whole search result, which may be more than the records
+            # loaded in the list view; active_domain alone is no sign of that,
+            # the list view passes it with every selection
+            values["domain"] = repr(active_domain)
+        else:
+            selected_ids = self.env.context.get("active_ids", [])
+            if not selected_ids:
+                raise UserError(_("No attachments selected."))
+            values["attachment_ids"] = [(6, 0, selected_ids)]
+
+        download = self.create(values)
+        if not download._get_downloadable_attachments(limit=1):
+            raise UserError(_("No binary attachments available for download."))
+        download._get_filename()
+        return download.download_attachment()
+
+    def download_attachment(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_url",
+            "url": "/web/attachment/download_zip/{}".format(self.token),
+            "target": "self",
+        }
+
+    def _get_downloadable_attachments(self, limit=None):
+        self.ensure_one()
+        domain = [("type", "=", "binary")]
+        if self.domain:
+            domain += safe_eval(self.domain)
+        else:
+            domain.append(("id", "in", self.attachment_ids.ids))
+        return self.env["ir.attachment"].search(domain, limit=limit)
+
+    def _get_filename(self):
+        self.ensure_one()   # only one record
+
+        base_name, __ = split_extension(self.name)
+        existing_names = self.search(
+            [("name", "ilike", base_name), ("id", "!=", self.id)]
+        ).mapped("name")
+        self.name = UniqueNameAllocator(existing_names).allocate(self.name)
@@ -1,10 +1,104 @@
-import base64
-import zipfile
-from datetime import datetime
-from io import BytesIO
+import calendar
+import csv
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import StringIO
 
 from odoo import _, api, fields, models
-from odoo.exceptions import UserError
+from odoo.exceptions import UserError, ValidationError
+
+from ..tools.archive_writer import (
+    ARCHIVE_EXTENSIONS,
+    ARCHIVE_FORMATS,
+    ARCHIVE_MIMETYPES,
+    is_format_available,
+    new_archive_writer,
+)
+from ..tools.name_allocator import UniqueNameAllocator
+from ..tools.zip_stream import (
+    DEFAULT_LEVEL,
+    ZIP_DEFLATED,
+    ZIP_STORED,
+    CompressedData,
+)
+from .ir_attachment import iter_raw_source
+
+_logger = logging.getLogger(__name__)
+
+DUPLICATES_ENTRY_NAME = "_duplicates.csv"
+MANIFEST_ENTRY_NAME = "_manifest.csv"
+# entries describing the archive itself, not attachments
+METADATA_ENTRY_NAMES = (DUPLICATES_ENTRY_NAME, MANIFEST_ENTRY_NAME)
+# fixed entry time of those, earliest time a ZIP entry can hold
+METADATA_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+PROBE_SIZE = 64 * 1024
+PROBE_MAX_RATIO = 0.9
+
+INCOMPRESSIBLE_MIMETYPES = {
+    "application/pdf",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/zstd",
+    "application/epub+zip",
+}
+INCOMPRESSIBLE_MIMETYPE_PREFIXES = (
+    "image/jpeg",
+    "image/png",
+    "image/gif",
+    "image/webp",
+    "audio/",
+    "video/",
+    "application/vnd.openxmlformats-officedocument.",
+    "application/vnd.oasis.opendocument.",
+)
+INCOMPRESSIBLE_EXTENSIONS = {
+    "pdf", "jpg", "jpeg", "png", "gif", "webp", "heic", "mp3", "mp4", "mov",
+    "avi", "mkv", "zip", "gz", "tgz", "bz2", "xz", "7z", "rar", "zst",
+    "docx", "xlsx", "pptx", "odt", "ods", "odp", "epub",
+}
+
+
+def _choose_compression(policy, level, incompressible, sample):
+    if policy == "store":
+        return ZIP_STORED, level
+    if policy == "deflate":
+        return ZIP_DEFLATED, level
+    if policy == "probe":
+        sample = sample[:PROBE_SIZE]
+        compressed_size = len(zlib.compress(sample, 1))
+        if sample and compressed_size > PROBE_MAX_RATIO * len(sample):
+            return ZIP_STORED, level
+        return ZIP_DEFLATED, level
+    if incompressible:
+        return ZIP_STORED, level
+    return ZIP_DEFLATED, level
+
+
+def _compress_source(full_path, raw_data, policy, level, incompressible):
+    """Read and compress one attachment; runs in a pack worker thread."""
+    chunks = iter_raw_source(full_path, raw_data)
+    first_chunk = next(chunks, b"")
+    compress_type, level = _choose_compression(
+        policy, level, incompressible, first_chunk
+    )
+    compressed = CompressedData(compress_type, level)
+    compressed.write(first_chunk)
+    for chunk in chunks:
+        compressed.write(chunk)
+    return compressed.finish()
 
 
 class IrAttachmentExport(models.Model):
@@ -19,28 +113,162 @@ class IrAttachmentExport(models.Model):
 
     model_ids = fields.Many2many(comodel_name="ir.model", string="Models")
 
+    profile_id = fields.Many2one(
+        comodel_name="ir.attachment.export.profile",
+        string="Export Profile",
+        readonly=True,
+        ondelete="set null",
+    )
+
     attachment_ids = fields.Many2many(
         comodel_name="ir.attachment", string="Attachments"
     )
 
-    total_attachment_size = fields.Char(
-        string="Total File Size",
+    attachment_count = fields.Integer(
+        string="Files",
+        readonly=True,
+        compute="_compute_attachment_totals",
+        store=True,
+    )
+    total_attachment_bytes = fields.Float(
+        string="Total File Size (Bytes)",
+        digits=(20, 0),
         readonly=True,
-        compute="_compute_total_attachment_size",
+        compute="_compute_attachment_totals",
         store=True,
     )
+    total_attachment_size = fields.Char(
+        string="Total File Size", compute="_compute_total_attachment_size"
+    )
 
     state = fields.Selection(
-        [("draft", "Draft"), ("open", "Open"), ("done", "Done")],
+        [
+            ("draft", "Draft"),
+            ("open", "Open"),
+            ("queued", "Queued"),
+            ("running", "Running"),
+            ("done", "Done"),
+        ],
         string="State",
         default="draft",
     )
 
+    deduplicate = fields.Boolean(
+        string="Store Duplicates Once",
+        help="Attachments with identical content are compressed and stored "
+        "once per archive. The left out copies are listed with the entry "
+        "holding their content in _duplicates.csv.",
+    )
+    max_part_size = fields.Integer(
+        string="Maximum Part Size (MB)",
+        help="Split the export into several archives whose files add up to at "
+        "most this size. 0 packs everything into a single archive.",
+    )
+    part_ids = fields.One2many(
+        comodel_name="ir.attachment.export.part",
+        inverse_name="export_id",
+        string="Archives",
+        readonly=True,
+    )
+
+    stage_ids = fields.One2many(
+        comodel_name="ir.attachment.export.stage",
+        inverse_name="export_id",
+        string="Stages",
+        readonly=True,
+    )
+
+    progress_files_done = fields.Integer(
+        string="Files Packed", compute="_compute_progress"
+    )
+    progress_files_total = fields.Integer(
+        string="Files to Pack", compute="_compute_progress"
+    )
+    progress_bytes_done = fields.Float(
+        string="Bytes Packed", digits=(20, 0), compute="_compute_progress"
+    )
+    progress_bytes_total = fields.Float(
+        string="Bytes to Pack", digits=(20, 0), compute="_compute_progress"
+    )
+    progress_percent = fields.Float(string="Progress", compute="_compute_progress")
+    progress_eta = fields.Datetime(
+        string="Estimated Completion", compute="_compute_progress"
+    )
+    job_start_date = fields.Datetime(string="Job Started", compute="_compute_progress")
+    job_error = fields.Text(string="Job Error", compute="_compute_progress")
+
+    archive_format = fields.Selection(
+        ARCHIVE_FORMATS,
+        string="Archive Format",
+        default="zip",
+        required=True,
+        help="ZIP compresses each file on its own, depending on the "
+        "compression policy. TAR archives are compressed as a whole stream; "
+        "Zstandard needs the python package zstandard.",
+    )
+    compression_policy = fields.Selection(
+        [
+            ("auto", "By File Type"),
+            ("probe", "By Sample"),
+            ("deflate", "Always Compress"),
+            ("store", "Never Compress"),
+        ],
+        string="Compression",
+        default="auto",
+        required=True,
+        help="By File Type stores formats that are already compressed (PDF, "
+        "JPEG, PNG, Office documents, archives) without deflating them. "
+        "By Sample compresses the start of each file and only deflates the "
+        "file if the sample shrinks noticeably.",
+    )
+    compression_level = fields.Integer(
+        string="Compression Level",
+        default=DEFAULT_LEVEL,
+        required=True,
+        help="Compression level from 1 (fastest) to 9 (smallest).",
+    )
+
+    model_stat_ids = fields.Many2many(
+        comodel_name="ir.attachment.model.stat",
+        string="Files per Model",
+        compute="_compute_model_stat_ids",
+    )
+
     model_ids_domain = fields.Char(
         string="Model IDs Domain",
         default=lambda self: str([("transient", "=", False)]),
     )
 
+    @api.constrains("compression_level")
+    def _check_compression_level(self):
+        for record in self:
+            if not 1 <= record.compression_level <= 9:
+                raise ValidationError(
+                    _("The compression level must be between 1 and 9.")
+                )
+
+    @api.constrains("archive_format")
+    def _check_archive_format(self):
+        for record in self:
+            if not is_format_available(record.archive_format):
+                raise ValidationError(
+                    _("The python package zstandard is not installed.")
+                )
+
+    @api.depends("model_ids")
+    def _compute_model_stat_ids(self):
+        stats = self.env["ir.attachment.model.stat"]._get_stats()
+        all_stats = self.env["ir.attachment.model.stat"].browse(
+            [stat.id for stat in stats.values()]
+        )
+        for record in self:
+            if record.model_ids:
+                record.model_stat_ids = all_stats.filtered(
+                    lambda x: x.res_model in record.model_ids.mapped("model")
+                )
+            else:
+                record.model_stat_ids = all_stats
+
     @api.onchange("model_ids")
     def _onchange_model_ids(self):
         models_with_files = self._get_models()
@@ -54,21 +282,24 @@ class IrAttachmentExport(models.Model):
         }
 
     def _get_excluded_files_domains(self):
-        return [
-            ("name", "not ilike", ".js"),
-            ("name", "not ilike", ".css"),
-            ("name", "not ilike", ".json"),
-            ("name", "not ilike", ".zip"),
+        return [("file_extension", "not in", ["js", "css", "json", "zip"])]
+
+    def _get_models_domain(self):
+        domain = [
+            ("res_id", "!=", False),
+            ("res_model", "!=", False),
+            ("res_model", "!=", "ir.attachment.export"),
         ]
+        domain.extend(self._get_excluded_files_domains())
+        return domain
 
     def _get_models(self, domain=None):
         if domain is None:
-            domain = [
-                ("res_id", "!=", False),
-                ("res_model", "!=", False),
-                ("res_model", "!=", "ir.attachment.export"),
-            ]
-            domain.extend(self._get_excluded_files_domains())
+            stats = self.env["ir.attachment.model.stat"]._get_stats()
+            if stats:
+                return list(stats)
+            # not refreshed yet, e.g. right after the module was upgraded
+            domain = self._get_models_domain()
 
         attachments = self.env["ir.attachment"].read_group(
             domain,
@@ -98,25 +329,66 @@ class IrAttachmentExport(models.Model):
         return domain
 
     def action_check_attachments(self):
-        self.attachment_ids = self.env["ir.attachment"].search(self._get_domain())
+        with self._measure_stage("search") as metrics:
+            candidates = self.env["ir.attachment"].search(self._get_domain())
+            metrics["files"] = len(candidates)
+
+        # candidates claimed by a concurrent export in the meantime are
+        # left out, so no attachment ends up in two exports
+        with self._measure_stage("flag") as metrics:
+            attachments = candidates._claim_for_export(self.id)
+            metrics["files"] = len(attachments)
 
-        if not self.attachment_ids:
+        if not attachments:
             error_message = _("No attachments found with the given criteria.")
             raise UserError(error_message)
 
-        for attachment in self.attachment_ids:
-            attachment.is_exported = True
+        self.attachment_ids = attachments
 
         self._generate_name()
         self.state = "open"
 
     @api.depends("attachment_ids")
+    def _compute_attachment_totals(self):
+        """Aggregate count and size of the attachments in SQL.
+
+        Avoids loading every linked attachment into the cache, which made
+        the export list slow for large exports.
+        """
+        field = self._fields["attachment_ids"]
+        export_ids = tuple(record.id for record in self if isinstance(record.id, int))
+        totals = {}
+        if export_ids:
+            self.env.cr.execute(
+                """
+                SELECT rel.{export_column}, COUNT(*), COALESCE(SUM(a.file_size), 0)
+                FROM {relation} rel
+                JOIN ir_attachment a ON a.id = rel.{attachment_column}
+                WHERE rel.{export_column} IN %s
+                GROUP BY rel.{export_column}
+                """.format(
+                    relation=field.relation,
+                    export_column=field.column1,
+                    attachment_column=field.column2,
+                ),
+                (export_ids,),
+            )
+            totals = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+        for record in self:
+            if isinstance(record.id, int):
+                count, total_bytes = totals.get(record.id, (0, 0))
+            else:
+                count = len(record.attachment_ids)
+                total_bytes = sum(record.attachment_ids.mapped("file_size"))
+            record.attachment_count = count
+            record.total_attachment_bytes = total_bytes
+
+    @api.depends("total_attachment_bytes")
     def _compute_total_attachment_size(self):
         for record in self:
-            total_size_bytes = sum(
-                attachment.file_size or 0 for attachment in record.attachment_ids
+            record.total_attachment_size = self._format_size(
+                int(record.total_attachment_bytes)
             )
-            record.total_attachment_size = self._format_size(total_size_bytes)
 
     @api.model
     def _format_size(self, size_in_bytes):
@@ -129,49 +401,523 @@ class IrAttachmentExport(models.Model):
         else:
             return "{} bytes".format(size_in_bytes)
 
-    def _create_zip_data(self):
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-            name_count = {}
-            for attachment in self.attachment_ids:
-                file_content = base64.b64decode(attachment.datas)
-                original_name = attachment.name or attachment.datas_fname
-                base_name, extension = original_name, ""
-                if "." in original_name:
-                    base_name, extension = original_name.rsplit(".", 1)
-                    extension = "." + extension
-                if original_name in name_count:
-                    name_count[original_name] += 1
-                    file_name = "{} ({}){}".format(
-                        base_name, name_count[original_name], extension
+    @api.depends(
+        "part_ids.state",
+        "part_ids.files_total",
+        "part_ids.bytes_total",
+        "part_ids.progress_files_done",
+        "part_ids.progress_bytes_done",
+        "part_ids.job_start_date",
+        "part_ids.job_error",
+    )
+    def _compute_progress(self):
+        now = datetime.now()
+        for record in self:
+            parts = record.part_ids
+            record.progress_files_done = sum(parts.mapped("progress_files_done"))
+            record.progress_files_total = sum(parts.mapped("files_total"))
+            record.progress_bytes_done = sum(parts.mapped("progress_bytes_done"))
+            record.progress_bytes_total = sum(parts.mapped("bytes_total"))
+            record.job_error = "\n".join(filter(None, parts.mapped("job_error")))
+
+            start_dates = list(filter(None, parts.mapped("job_start_date")))
+            record.job_start_date = min(start_dates) if start_dates else False
+
+            if record.progress_bytes_total:
+                record.progress_percent = (
+                    100.0 * record.progress_bytes_done / record.progress_bytes_total
+                )
+            else:
+                record.progress_percent = 100.0 if record.state == "done" else 0.0
+
+            record.progress_eta = False
+            if record.state == "running" and record.progress_bytes_done:
+                start_date = fields.Datetime.from_string(record.job_start_date)
+                elapsed = (now - start_date).total_seconds()
+                remaining = (
+                    elapsed
+                    * (record.progress_bytes_total - record.progress_bytes_done)
+                    / record.progress_bytes_done
+                )
+                record.progress_eta = fields.Datetime.to_string(
+                    now + timedelta(seconds=remaining)
+                )
+
+    @api.model
+    def _get_param(self, key, default):
+        value = self.env["ir.config_parameter"].sudo().get_param(
+            "dms_attachment_manager." + key
+        )
+        try:
+            return int(value) if value else default
+        except ValueError:
+            return default
+
+    @api.model
+    def _get_pack_executor(self):
+        """Return a thread pool reading and compressing entries, or None.
+
+        zlib and file reads release the GIL, so threads scale with the cores.
+        TAR archives are compressed as one stream, so entries are not
+        compressed ahead.
+        """
+        workers = self._get_param("pack_workers", 1)
+        if workers <= 1 or (self.archive_format or "zip") != "zip":
+            return None
+        return ThreadPoolExecutor(max_workers=workers)
+
+    def _new_archive_writer(self, fileobj, offset=0, entries=None):
+        """Return the streaming writer for the archive format of the export.
+
+        Zstandard compresses on as many threads as there are pack workers.
+        ``offset`` and ``entries`` continue an archive from a checkpoint.
+        """
+        return new_archive_writer(
+            self.archive_format or "zip",
+            fileobj,
+            level=self.compression_level or DEFAULT_LEVEL,
+            threads=self._get_param("pack_workers", 1),
+            offset=offset,
+            entries=entries,
+        )
+
+    def _create_zip_data(self, fileobj, attachments, batch_callback=None):
+        zip_writer = self._new_archive_writer(fileobj)
+        self._write_zip_batches(zip_writer, attachments, batch_callback=batch_callback)
+        zip_writer.close()
+        return zip_writer
+
+    @contextmanager
+    def _measure_stage(self, stage, part=None):
+        """Record duration and query count of the enclosed code as ``stage``.
+
+        The enclosed code adds ``files``, ``bytes_read`` and ``bytes_written``
+        to the yielded dict. Each stage is also logged as one JSON line.
+        """
+        cr = self.env.cr
+        metrics = {"files": 0, "bytes_read": 0, "bytes_written": 0}
+        query_count = cr.sql_log_count
+        start = time.time()
+        yield metrics
+        metrics.update(
+            {
+                "export_id": self.id,
+                "part_id": part.id if part else False,
+                "name": stage,
+                "seconds": time.time() - start,
+                "query_count": cr.sql_log_count - query_count,
+            }
+        )
+        self.env["ir.attachment.export.stage"].create(metrics)
+        _logger.info("Attachment export stage %s", json.dumps(metrics, sort_keys=True))
+
+    def _write_zip_batches(
+        self,
+        zip_writer,
+        attachments,
+        batch_callback=None,
+        skip_count=0,
+        max_batches=None,
+    ):
+        """Write ``attachments`` to the archive in batches.
+
+        Only one batch is kept in the cache at a time. The first
+        ``skip_count`` attachments are already in the archive of a resumed
+        job; they are only named again, so the following entries get the same
+        names as in an uninterrupted run. With ``max_batches``, returns False
+        instead of writing a further batch; the archive is then continued
+        from its checkpoint later. Returns True once all entries are written.
+        """
+        batch_size = self._get_param("export_batch_size", 500)
+        name_allocator = UniqueNameAllocator(METADATA_ENTRY_NAMES)
+        # checksum -> name of the entry holding that content
+        stored_checksums = {} if self.deduplicate else None
+        duplicates = []
+        manifest = []
+        executor = self._get_pack_executor()
+        start = 0
+        batch_count = 0
+        try:
+            for batch in attachments._iter_batches(batch_size):
+                batch_skip = max(0, skip_count - start)
+                start += len(batch)
+                if batch_skip < len(batch):
+                    if max_batches is not None and batch_count >= max_batches:
+                        return False
+                    batch_count += 1
+                self._write_zip_batch(
+                    zip_writer,
+                    batch,
+                    name_allocator,
+                    executor,
+                    skip_count=batch_skip,
+                    stored_checksums=stored_checksums,
+                    duplicates=duplicates,
+                    manifest=manifest,
+                )
+                if batch_callback and batch_skip < len(batch):
+                    batch_callback(batch[batch_skip:])
+        finally:
+            if executor:
+                executor.shutdown()
+
+        if duplicates:
+            # mapping of left out duplicates to their stored entry
+            self._write_csv_entry(
+                zip_writer,
+                DUPLICATES_ENTRY_NAME,
+                ["file", "stored_as", "attachment_id"],
+                duplicates,
+            )
+        self._write_manifest_entry(zip_writer, manifest)
+        return True
+
+    def _write_manifest_entry(self, zip_writer, manifest):
+        """Write where each attachment is stored in the archive.
+
+        ``manifest`` holds ``(attachment_id, res_model, res_id, file_name,
+        checksum)`` rows. Size and offset are taken from the written entries,
+        so consumers can verify the archive and extract single files without
+        scanning it. The offset is the position of the local header in a ZIP
+        archive and of the entry data in the uncompressed TAR stream.
+        """
+        entries = {entry.name: entry for entry in zip_writer.entries}
+        rows = []
+        for attachment_id, res_model, res_id, file_name, checksum in manifest:
+            entry = entries[file_name]
+            rows.append(
+                [
+                    attachment_id,
+                    res_model,
+                    res_id,
+                    file_name,
+                    entry.file_size,
+                    checksum or "",
+                    entry.offset,
+                ]
+            )
+        self._write_csv_entry(
+            zip_writer,
+            MANIFEST_ENTRY_NAME,
+            [
+                "attachment_id",
+                "res_model",
+                "res_id",
+                "file",
+                "size",
+                "checksum",
+                "offset",
+            ],
+            rows,
+        )
+
+    def _write_csv_entry(self, zip_writer, name, header, rows):
+        """Write ``rows`` as a ``;`` separated CSV file to the archive."""
+        content = StringIO()
+        writer = csv.writer(content, delimiter=";")
+        writer.writerow(header)
+        writer.writerows(rows)
+        zip_writer.write_entry(
+            name,
+            [content.getvalue().encode("utf-8")],
+            date_time=METADATA_DATE_TIME,
+        )
+
+    def _write_zip_batch(
+        self,
+        zip_writer,
+        attachments,
+        name_allocator,
+        executor=None,
+        skip_count=0,
+        stored_checksums=None,
+        duplicates=None,
+        manifest=None,
+    ):
+        named_attachments = []
+        for index, attachment in enumerate(attachments):
+            file_name = name_allocator.allocate(
+                attachment.name or attachment.datas_fname
+            )
+
+            checksum = attachment.checksum
+            stored_as = file_name
+            if stored_checksums is not None and checksum:
+                stored_as = stored_checksums.setdefault(checksum, file_name)
+            if manifest is not None:
+                manifest.append(
+                    (
+                        attachment.id,
+                        attachment.res_model,
+                        attachment.res_id,
+                        stored_as,
+                        checksum,
                     )
-                else:
-                    name_count[original_name] = 0
-                    file_name = original_name
+                )
+            if stored_as != file_name:
+                duplicates.append((file_name, stored_as, attachment.id))
+                continue
+            if index >= skip_count:
+                named_attachments.append((file_name, attachment))
 
-                zipf.writestr(file_name, file_content)
+        for __ in self._iter_zip_entries(zip_writer, named_attachments, executor):
+            pass
 
-        zip_buffer.seek(0)
-        return zip_buffer.getvalue()
+    def _iter_zip_entries(self, zip_writer, named_attachments, executor=None):
+        """Write ``(file_name, attachment)`` pairs to the archive in order.
 
-    def pack_zip(self):
-        zip_data = self._create_zip_data()
-        zip_name = "{}.zip".format(self.name)
-        encoded_zip = base64.b64encode(zip_data)
-        self.env["ir.attachment"].create(
+        With an executor, its workers read and compress the next entries while
+        this single writer appends the finished ones. Yields after every chunk
+        written, so a caller streaming the archive can drain its buffer.
+        """
+        if executor is None:
+            for file_name, attachment in named_attachments:
+                for __ in self._iter_zip_entry(zip_writer, file_name, attachment):
+                    yield
+            return
+
+        window = 2 * self._get_param("pack_workers", 1)
+        pending = deque()
+        try:
+            for file_name, attachment in named_attachments:
+                full_path, raw_data = attachment._get_raw_source()
+                future = executor.submit(
+                    _compress_source,
+                    full_path,
+                    raw_data,
+                    self.compression_policy or "auto",
+                    self.compression_level or DEFAULT_LEVEL,
+                    self._is_incompressible(attachment),
+                )
+                date_time = self._get_entry_date_time(attachment)
+                pending.append((file_name, date_time, future))
+                while len(pending) >= window:
+                    for __ in self._iter_compressed_entry(
+                        zip_writer, *pending.popleft()
+                    ):
+                        yield
+            while pending:
+                for __ in self._iter_compressed_entry(zip_writer, *pending.popleft()):
+                    yield
+        finally:
+            for __, __, future in pending:
+                if not future.cancel() and not future.exception():
+                    future.result().close()
+
+    @api.model
+    def _iter_compressed_entry(self, zip_writer, file_name, date_time, future):
+        compressed = future.result()
+        try:
+            for __ in zip_writer.iter_compressed_entry(
+                file_name, compressed, date_time
+            ):
+                yield
+        finally:
+            compressed.close()
+
+    def _iter_zip_entry(self, zip_writer, file_name, attachment):
+        """Write ``attachment`` to the archive as ``file_name``.
+
+        Yields after every chunk, so a caller streaming the archive can drain
+        its buffer while the file is being read.
+        """
+        chunks = attachment._iter_raw_chunks()
+        first_chunk = next(chunks, b"")
+        compress_type, level = self._get_compression(attachment, first_chunk)
+        with zip_writer.open_entry(
+            file_name,
+            compress_type=compress_type,
+            level=level,
+            date_time=self._get_entry_date_time(attachment),
+            size_hint=attachment.file_size or 0,
+        ) as entry_writer:
+            entry_writer.write(first_chunk)
+            yield
+            for chunk in chunks:
+                entry_writer.write(chunk)
+                yield
+
+    @api.model
+    def _get_entry_date_time(self, attachment):
+        """Return the entry time of ``attachment`` in server local time.
+
+        Taken from the write date instead of the current time, so the same
+        attachments always give the same archive bytes.
+        """
+        if not attachment.write_date:
+            return METADATA_DATE_TIME
+        write_date = fields.Datetime.from_string(attachment.write_date)
+        return time.localtime(calendar.timegm(write_date.timetuple()))[:6]
+
+    def _get_compression(self, attachment, sample):
+        """Return the ZIP method and deflate level for ``attachment``.
+
+        Also usable on an empty recordset, which applies the defaults. TAR
+        writers ignore it, so no sample is compressed for them.
+        """
+        if (self.archive_format or "zip") != "zip":
+            return ZIP_STORED, DEFAULT_LEVEL
+        return _choose_compression(
+            self.compression_policy or "auto",
+            self.compression_level or DEFAULT_LEVEL,
+            self._is_incompressible(attachment),
+            sample,
+        )
+
+    @api.model
+    def _is_incompressible(self, attachment):
+        mimetype = attachment.mimetype or ""
+        if mimetype in INCOMPRESSIBLE_MIMETYPES or mimetype.startswith(
+            INCOMPRESSIBLE_MIMETYPE_PREFIXES
+        ):
+            return True
+        name = attachment.name or attachment.datas_fname or ""
+        return (
+            "." in name and name.rsplit(".", 1)[1].lower() in INCOMPRESSIBLE_EXTENSIONS
+        )
+
+    def _get_temp_dir(self):
+        temp_dir = os.path.join(self.env["ir.attachment"]._filestore(), "dms_export")
+        if not os.path.isdir(temp_dir):
+            os.makedirs(temp_dir)
+        return temp_dir
+
+    def _store_zip_file(self, path, zip_name, checksum=None):
+        """Register the archive at ``path`` as attachment of the export.
+
+        The file is moved into the filestore, so neither the archive nor its
+        base64 form is ever loaded into memory.
+        """
+        return self.env["ir.attachment"]._create_from_file(
+            path,
             {
                 "name": zip_name,
-                "datas": encoded_zip,
                 "datas_fname": zip_name,
                 "res_model": self._name,
                 "res_id": self.id,
-                "mimetype": "application/zip",
-            }
+                "mimetype": ARCHIVE_MIMETYPES[self.archive_format],
+            },
+            checksum=checksum,
         )
+
+    def _plan_parts(self):
+        """Split the attachments into parts of at most ``max_part_size``.
+
+        Parts are planned once, so a retry only repacks the parts that did
+        not finish. A single file larger than the limit gets a part of its own.
+        Only ids and sizes are fetched, in one query, so planning does not
+        load the attachments into the cache.
+        """
+        self.ensure_one()
+        if self.part_ids:
+            return self.part_ids
+
+        field = self._fields["attachment_ids"]
+        self.env.cr.execute(
+            """
+            SELECT a.id, COALESCE(a.file_size, 0)
+            FROM {relation} rel
+            JOIN ir_attachment a ON a.id = rel.{attachment_column}
+            WHERE rel.{export_column} = %s
+            ORDER BY a.id
+            """.format(
+                relation=field.relation,
+                export_column=field.column1,
+                attachment_column=field.column2,
+            ),
+            (self.id,),
+        )
+        size_limit = self.max_part_size * 1024 * 1024
+        groups = [[]]
+        group_size = 0
+        for attachment_id, file_size in self.env.cr.fetchall():
+            if size_limit and groups[-1] and group_size + file_size > size_limit:
+                groups.append([])
+                group_size = 0
+            groups[-1].append((attachment_id, file_size))
+            group_size += file_size
+
+        part_model = self.env["ir.attachment.export.part"]
+        extension = ARCHIVE_EXTENSIONS[self.archive_format]
+        for sequence, group in enumerate(groups, 1):
+            if len(groups) == 1:
+                zip_name = "{}{}".format(self.name, extension)
+            else:
+                zip_name = "{}_part{:02d}{}".format(self.name, sequence, extension)
+            part_model.create(
+                {
+                    "export_id": self.id,
+                    "sequence": sequence,
+                    "name": zip_name,
+                    "attachment_ids": [(6, 0, [x[0] for x in group])],
+                    "files_total": len(group),
+                    "bytes_total": sum(x[1] for x in group),
+                }
+            )
+        return self.part_ids
+
+    def pack_zip(self):
+        for part in self._plan_parts().filtered(lambda x: x.state != "done"):
+            part._pack()
         self.state = "done"
 
+    def action_pack_zip_async(self):
+        for record in self.filtered(lambda x: x.state == "open"):
+            record._plan_parts().filtered(lambda x: x.state != "done").write(
+                {"state": "queued", "job_error": False}
+            )
+            record.state = "queued"
+
+    @api.model
+    def _cron_process_export_queue(self):
+        """Pack queued export parts, ``export_cron_batches`` batches per run.
+
+        The packing runs in the cron job itself, within the time and memory
+        limits of its worker, and is committed after every batch. Parts that
+        are not finished when the batches are used up are continued from
+        their checkpoint by the next run. A part whose lock is held is being
+        packed by another run and is left alone.
+        """
+        part_model = self.env["ir.attachment.export.part"]
+        remaining = self._get_param("export_cron_batches", 20)
+        for part in part_model.search([("state", "in", ["queued", "running"])]):
+            if remaining <= 0:
+                break
+            if not part._try_job_lock():
+                continue
+            try:
+                remaining -= part._run_pack_job(max_batches=remaining)
+            finally:
+                part._release_job_lock()
+
+        self.search([("state", "in", ["queued", "running"])])._update_pack_state()
+        self._commit_progress()
+
+    def _update_pack_state(self):
+        # only the dispatcher writes the export, not the pack job of a part
+        for record in self:
+            states = set(record.part_ids.mapped("state"))
+            if states == {"done"}:
+                state = "done"
+            elif "running" in states:
+                state = "running"
+            elif "queued" in states:
+                state = "queued"
+            else:
+                state = "open"
+            if record.state != state:
+                record.state = state
+
+    @api.model
+    def _commit_progress(self):
+        # tests run in a single transaction that must not be committed
+        if not getattr(threading.currentThread(), "testing", False):
+            self.env.cr.commit()
+
     def unlink(self):
-        self.attachment_ids.write({"is_exported": False})
+        self.mapped("attachment_ids")._release_export_claims(self.ids)
+        # not left to the cascade, the parts remove their checkpoint files
+        self.mapped("part_ids").unlink()
         return super(IrAttachmentExport, self).unlink()
 
     def _generate_name(self):
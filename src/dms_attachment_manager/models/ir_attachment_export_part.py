@@ -0,0 +1,322 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+
+from odoo import _, fields, models
+
+from ..tools.archive_writer import ARCHIVE_EXTENSIONS, archive_entry_from_dict
+from ..tools.zip_stream import COPY_CHUNK_SIZE, HashingFile
+from .ir_attachment_export import METADATA_ENTRY_NAMES
+
+_logger = logging.getLogger(__name__)
+
+# first key of the advisory lock a pack job holds on its part, the part id
+# is the second
+JOB_LOCK_KEY = 7105
+
+
+class IrAttachmentExportPart(models.Model):
+    _name = "ir.attachment.export.part"
+    _description = "Attachment Export Part"
+    _order = "export_id, sequence"
+
+    export_id = fields.Many2one(
+        comodel_name="ir.attachment.export",
+        string="Export",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    sequence = fields.Integer(string="Part", default=1)
+    name = fields.Char(string="Archive Name", required=True)
+
+    attachment_ids = fields.Many2many(
+        comodel_name="ir.attachment",
+        relation="ir_attachment_export_part_rel",
+        column1="part_id",
+        column2="attachment_id",
+        string="Attachments",
+    )
+    archive_id = fields.Many2one(
+        comodel_name="ir.attachment", string="Archive", readonly=True
+    )
+
+    state = fields.Selection(
+        [
+            ("queued", "Queued"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        string="State",
+        default="queued",
+        required=True,
+        index=True,
+    )
+
+    files_total = fields.Integer(string="Files", readonly=True)
+    bytes_total = fields.Float(string="Bytes", digits=(20, 0), readonly=True)
+    progress_files_done = fields.Integer(string="Files Packed", readonly=True)
+    progress_bytes_done = fields.Float(
+        string="Bytes Packed", digits=(20, 0), readonly=True
+    )
+    job_start_date = fields.Datetime(string="Job Started", readonly=True)
+    job_heartbeat = fields.Datetime(string="Last Progress Update", readonly=True)
+    job_error = fields.Text(string="Job Error", readonly=True)
+
+    checkpoint_path = fields.Char(string="Partial Archive", readonly=True)
+    checkpoint_offset = fields.Float(
+        string="Checkpoint Offset", digits=(20, 0), readonly=True
+    )
+    checkpoint_entries = fields.Integer(string="Checkpoint Entries", readonly=True)
+    checkpoint_files = fields.Integer(string="Checkpoint Files", readonly=True)
+
+    def _pack(self, batch_callback=None):
+        """Pack the part in one go, writing progress after every batch.
+
+        The progress is written with ``batch_callback``, by default without
+        committing, so a synchronous run stays in one transaction.
+        """
+        self.ensure_one()
+        export = self.export_id
+        fd, temp_path = tempfile.mkstemp(suffix=".zip", dir=export._get_temp_dir())
+        # packed again from the start, so is the progress
+        self.write({"progress_files_done": 0, "progress_bytes_done": 0})
+        try:
+            with export._measure_stage("pack", self) as metrics:
+                # the checksum is computed while the archive is written
+                with os.fdopen(fd, "wb") as temp_file:
+                    archive_file = HashingFile(temp_file)
+                    zip_writer = export._create_zip_data(
+                        archive_file,
+                        self.attachment_ids,
+                        batch_callback=batch_callback or self._update_progress,
+                    )
+                self._add_archive_metrics(metrics, zip_writer)
+            archive = self._store_archive(temp_path, archive_file.hexdigest())
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        self.write({"archive_id": archive.id, "state": "done"})
+
+    def _pack_resumable(self, max_batches=None):
+        """Pack the part, continuing from the last checkpoint if there is one.
+
+        After every batch the partial archive and a journal of its entries
+        are synced to disk and their position is committed with the progress,
+        so a restarted job appends to the archive instead of starting over.
+        Stops after ``max_batches`` batches, the part stays running until a
+        later call packs the rest. Returns the number of batches packed.
+        """
+        self.ensure_one()
+        export = self.export_id
+        archive_file, zip_writer = self._open_checkpoint()
+        start_entries, start_offset = len(zip_writer.entries), zip_writer.offset
+        batch_count = [0]
+
+        def save_checkpoint(batch):
+            self._save_checkpoint(zip_writer, archive_file, batch)
+            batch_count[0] += 1
+
+        with export._measure_stage("pack", self) as metrics:
+            try:
+                finished = export._write_zip_batches(
+                    zip_writer,
+                    self.attachment_ids,
+                    batch_callback=save_checkpoint,
+                    skip_count=self.checkpoint_files,
+                    max_batches=max_batches,
+                )
+                if finished:
+                    zip_writer.close()
+            finally:
+                archive_file.close()
+            self._add_archive_metrics(
+                metrics, zip_writer, start_entries, start_offset
+            )
+        if not finished:
+            return batch_count[0]
+        archive = self._store_archive(
+            self.checkpoint_path, archive_file.hexdigest()
+        )
+        self._drop_checkpoint()
+        self.write({"archive_id": archive.id, "state": "done"})
+        return batch_count[0]
+
+    def _add_archive_metrics(
+        self, metrics, zip_writer, start_entries=0, start_offset=0
+    ):
+        entries = [
+            entry
+            for entry in zip_writer.entries[start_entries:]
+            if entry.name not in METADATA_ENTRY_NAMES
+        ]
+        metrics["files"] = len(entries)
+        metrics["bytes_read"] = sum(entry.file_size for entry in entries)
+        metrics["bytes_written"] = zip_writer.offset - start_offset
+
+    def _store_archive(self, path, checksum=None):
+        export = self.export_id
+        with export._measure_stage("store", self) as metrics:
+            # file_size of the archive stays empty from 2 GiB on
+            metrics["bytes_written"] = os.path.getsize(path)
+            archive = export._store_zip_file(path, self.name, checksum)
+            metrics["files"] = 1
+        return archive
+
+    def _open_checkpoint(self):
+        export = self.export_id
+        archive_format = export.archive_format or "zip"
+        path = self.checkpoint_path
+        journal_path = path and path + ".journal"
+        if not (path and os.path.isfile(path) and os.path.isfile(journal_path)):
+            self._drop_checkpoint()
+            fd, path = tempfile.mkstemp(
+                suffix=ARCHIVE_EXTENSIONS[archive_format],
+                dir=export._get_temp_dir(),
+            )
+            os.close(fd)
+            open(path + ".journal", "wb").close()
+            self.write(
+                {
+                    "checkpoint_path": path,
+                    "checkpoint_offset": 0,
+                    "checkpoint_entries": 0,
+                    "checkpoint_files": 0,
+                    "progress_files_done": 0,
+                    "progress_bytes_done": 0,
+                }
+            )
+            archive_file = HashingFile(open(path, "wb"))
+            return archive_file, export._new_archive_writer(archive_file)
+
+        # data written after the last committed checkpoint is discarded
+        entries = []
+        journal_size = 0
+        with open(journal_path, "rb") as journal_file:
+            for line in itertools.islice(journal_file, self.checkpoint_entries):
+                values = json.loads(line.decode("utf-8"))
+                entries.append(archive_entry_from_dict(archive_format, values))
+                journal_size += len(line)
+        with open(journal_path, "r+b") as journal_file:
+            journal_file.truncate(journal_size)
+
+        offset = int(self.checkpoint_offset)
+        archive_file = open(path, "r+b")
+        archive_file.truncate(offset)
+        # the checksum continues over the kept part of the archive
+        checksum = hashlib.sha1()
+        for chunk in iter(lambda: archive_file.read(COPY_CHUNK_SIZE), b""):
+            checksum.update(chunk)
+        archive_file.seek(offset)
+        archive_file = HashingFile(archive_file, checksum)
+        return archive_file, export._new_archive_writer(archive_file, offset, entries)
+
+    def _save_checkpoint(self, zip_writer, archive_file, attachments):
+        zip_writer.checkpoint()
+        archive_file.flush()
+        os.fsync(archive_file.fileno())
+        with open(self.checkpoint_path + ".journal", "ab") as journal_file:
+            for entry in zip_writer.entries[self.checkpoint_entries:]:
+                journal_file.write(json.dumps(entry.to_dict()).encode("utf-8"))
+                journal_file.write(b"\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.write(
+            {
+                "checkpoint_offset": zip_writer.offset,
+                "checkpoint_entries": len(zip_writer.entries),
+                "checkpoint_files": self.checkpoint_files + len(attachments),
+            }
+        )
+        self._record_progress(attachments)
+
+    def _drop_checkpoint(self):
+        self._remove_checkpoint_files(self.checkpoint_path)
+        self.checkpoint_path = False
+
+    def _remove_checkpoint_files(self, path):
+        for file_path in filter(None, [path, path and path + ".journal"]):
+            if os.path.isfile(file_path):
+                os.unlink(file_path)
+
+    def unlink(self):
+        # also reached when an export is deleted, the cascade in the
+        # database would leave the files behind
+        for part in self:
+            part._remove_checkpoint_files(part.checkpoint_path)
+        return super(IrAttachmentExportPart, self).unlink()
+
+    def _try_job_lock(self):
+        """Take the lock of the pack job of the part, or return False.
+
+        The lock belongs to the database session and is kept across the
+        commits of the job, so a part is never packed by two runs at once.
+        """
+        self.ensure_one()
+        self.env.cr.execute(
+            "SELECT pg_try_advisory_lock(%s, %s)", (JOB_LOCK_KEY, self.id)
+        )
+        return self.env.cr.fetchone()[0]
+
+    def _release_job_lock(self):
+        self.ensure_one()
+        self.env.cr.execute(
+            "SELECT pg_advisory_unlock(%s, %s)", (JOB_LOCK_KEY, self.id)
+        )
+
+    def _run_pack_job(self, max_batches=None):
+        """Pack up to ``max_batches`` batches of the part and commit.
+
+        Failures are recorded on the part instead of raised. Returns the
+        number of batches packed.
+        """
+        self.ensure_one()
+        now = fields.Datetime.now()
+        self.write(
+            {
+                "state": "running",
+                "job_start_date": self.job_start_date or now,
+                "job_heartbeat": now,
+                "job_error": False,
+            }
+        )
+        batch_count = 0
+        try:
+            batch_count = self._pack_resumable(max_batches)
+        except Exception as error:
+            _logger.exception("Part %s of attachment export failed", self.name)
+            checkpoint_path = self.checkpoint_path
+            self.env.cr.rollback()
+            self.invalidate_cache(["checkpoint_path"], self.ids)
+            # files of a checkpoint that was never committed are unknown
+            # after the rollback
+            if checkpoint_path != self.checkpoint_path:
+                self._remove_checkpoint_files(checkpoint_path)
+            self.write(
+                {
+                    "state": "failed",
+                    "job_error": _("{}: {}").format(self.name, error),
+                }
+            )
+        self.export_id._commit_progress()
+        return batch_count
+
+    def _record_progress(self, attachments):
+        """Write and commit the progress of a background job."""
+        self._update_progress(attachments)
+        self.export_id._commit_progress()
+
+    def _update_progress(self, attachments):
+        self.write(
+            {
+                "progress_files_done": self.progress_files_done + len(attachments),
+                "progress_bytes_done": self.progress_bytes_done
+                + sum(attachments.mapped("file_size")),
+                "job_heartbeat": fields.Datetime.to_string(datetime.now()),
+            }
+        )
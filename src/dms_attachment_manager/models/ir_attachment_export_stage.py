@@ -0,0 +1,49 @@
+from odoo import api, fields, models
+
+
+class IrAttachmentExportStage(models.Model):
+    """Duration and volume of one stage of an export run."""
+
+    _name = "ir.attachment.export.stage"
+    _description = "Attachment Export Stage"
+    _order = "export_id, id"
+
+    export_id = fields.Many2one(
+        comodel_name="ir.attachment.export",
+        string="Export",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    part_id = fields.Many2one(
+        comodel_name="ir.attachment.export.part",
+        string="Archive",
+        ondelete="cascade",
+    )
+    name = fields.Selection(
+        [
+            ("search", "Search"),
+            ("flag", "Flag as Exported"),
+            ("pack", "Read and Compress"),
+            ("store", "Store Archive"),
+        ],
+        string="Stage",
+        required=True,
+    )
+    seconds = fields.Float(string="Seconds", digits=(16, 3))
+    query_count = fields.Integer(string="Queries")
+    files = fields.Integer(string="Files")
+    bytes_read = fields.Float(string="Bytes Read", digits=(20, 0))
+    bytes_written = fields.Float(string="Bytes Written", digits=(20, 0))
+    compression_ratio = fields.Float(
+        string="Compression Ratio",
+        digits=(16, 2),
+        compute="_compute_compression_ratio",
+    )
+
+    @api.depends("bytes_read", "bytes_written")
+    def _compute_compression_ratio(self):
+        for stage in self:
+            stage.compression_ratio = (
+                stage.bytes_written / stage.bytes_read if stage.bytes_read else 0.0
+            )
@@ -0,0 +1,54 @@
+from odoo import api, fields, models
+
+
+class IrAttachmentModelStat(models.Model):
+    """Attachment count and size per model, shared by all workers.
+
+    Refreshed by cron, so the export wizard does not have to group the whole
+    attachment table every time its models change.
+    """
+
+    _name = "ir.attachment.model.stat"
+    _description = "Attachment Model Statistics"
+    _order = "res_model"
+    _rec_name = "res_model"
+
+    res_model = fields.Char(string="Model", required=True, index=True)
+    attachment_count = fields.Integer(string="Files", readonly=True)
+    total_bytes = fields.Float(
+        string="Total File Size (Bytes)", digits=(20, 0), readonly=True
+    )
+    total_size = fields.Char(string="Total File Size", compute="_compute_total_size")
+
+    _sql_constraints = [
+        ("res_model_unique", "unique(res_model)", "Statistics exist per model once.")
+    ]
+
+    @api.depends("total_bytes")
+    def _compute_total_size(self):
+        export_model = self.env["ir.attachment.export"]
+        for record in self:
+            record.total_size = export_model._format_size(int(record.total_bytes))
+
+    @api.model
+    def _refresh(self):
+        groups = self.env["ir.attachment"].read_group(
+            self.env["ir.attachment.export"]._get_models_domain(),
+            ["res_model", "file_size"],
+            ["res_model"],
+        )
+        self.search([]).unlink()
+        for group in groups:
+            if group["res_model"]:
+                self.create(
+                    {
+                        "res_model": group["res_model"],
+                        "attachment_count": group["res_model_count"],
+                        "total_bytes": group["file_size"] or 0,
+                    }
+                )
+
+    @api.model
+    def _get_stats(self):
+        """Return ``{res_model: stat record}`` for models with attachments."""
+        return {record.res_model: record for record in self.search([])}
@@ -1 +1,2 @@
-from . import test_ir_attachment_export, test_ir_attachment
\ No newline at end of file
+from . import test_ir_attachment_export, test_ir_attachment, test_ir_attachment_export_profile
+from . import test_ir_attachment_download
\ No newline at end of file
@@ -1,6 +1,12 @@
 from odoo.tests.common import TransactionCase
 from datetime import date, timedelta
 import base64
+import hashlib
+import os
+import tempfile
+from unittest.mock import patch
+
+from ..models import ir_attachment
 
 class TestIrAttachmentExportIsExported(TransactionCase):
     def setUp(self):
@@ -38,3 +44,88 @@ class TestIrAttachmentExportIsExported(TransactionCase):
         self.export.unlink()
         self.attachment.invalidate_cache()
         self.assertFalse(self.attachment.is_exported)
+
+    def test_raw_chunks_match_content(self):
+        """Testet, ob die Rohdaten ohne Umweg über 'datas' gelesen werden."""
+        raw_data = b"".join(self.attachment._iter_raw_chunks(chunk_size=3))
+        self.assertEqual(raw_data, b'Testflag')
+
+    def test_file_extension_stored(self):
+        """Testet, ob die Dateiendung beim Anlegen gespeichert wird."""
+        self.assertEqual(self.attachment.file_extension, 'pdf')
+
+    def test_split_by_access(self):
+        """Testet, ob Anhänge ohne Leserecht gesammelt aussortiert werden."""
+        user = self.env['res.users'].create({
+            'name': 'DMS Leser',
+            'login': 'dms_reader',
+            'groups_id': [(6, 0, [self.env.ref('base.group_user').id])],
+        })
+        hidden = self.env['ir.attachment'].create({
+            'name': 'hidden.pdf',
+            'datas': base64.b64encode(b'Geheim').decode('utf-8'),
+            'datas_fname': 'hidden.pdf',
+            'res_model': 'ir.attachment.export',
+            'res_id': self.export.id,
+        })
+
+        attachments = (self.attachment + hidden).sudo(user)
+        allowed, denied = attachments._split_by_access('read')
+        self.assertEqual(allowed.ids, self.attachment.ids)
+        self.assertEqual(denied.ids, hidden.ids)
+
+    def test_create_from_file(self):
+        """Testet, ob ein Anhang direkt aus einer Datei angelegt wird."""
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(b'Dateiinhalt')
+
+        attachment = self.env['ir.attachment']._create_from_file(
+            path, {'name': 'datei.txt', 'datas_fname': 'datei.txt'})
+        self.assertEqual(base64.b64decode(attachment.datas), b'Dateiinhalt')
+        self.assertEqual(attachment.file_size, 11)
+        self.assertEqual(attachment.checksum, hashlib.sha1(b'Dateiinhalt').hexdigest())
+        self.assertFalse(os.path.exists(path))
+
+    def test_create_from_file_too_large_for_file_size(self):
+        """Testet, ob 'file_size' bei Dateien über der Spaltengrenze leer bleibt."""
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(b'Grosse Datei')
+
+        with patch.object(ir_attachment, 'MAX_FILE_SIZE', 5):
+            attachment = self.env['ir.attachment']._create_from_file(
+                path, {'name': 'gross.zip', 'datas_fname': 'gross.zip'})
+        self.assertFalse(attachment.file_size)
+        self.assertEqual(attachment.checksum, hashlib.sha1(b'Grosse Datei').hexdigest())
+        self.assertEqual(base64.b64decode(attachment.datas), b'Grosse Datei')
+
+    def test_batches_drop_cache(self):
+        """Testet, ob der Cache eines Stapels nach der Verarbeitung verworfen wird."""
+        attachments = self.attachment + self.attachment.copy()
+        batch_sizes = []
+        for batch in attachments._iter_batches(1):
+            batch.mapped('name')
+            batch_sizes.append(len(batch))
+        self.assertEqual(batch_sizes, [1, 1])
+
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET name = 'neu.pdf' WHERE id IN %s",
+            (tuple(attachments.ids),))
+        self.assertEqual(set(attachments.mapped('name')), {'neu.pdf'})
+
+    def test_claim_skips_claimed_attachments(self):
+        """Testet, ob ein bereits beanspruchter Anhang nicht erneut exportiert wird."""
+        other_export = self.export.copy()
+
+        claimed = self.attachment._claim_for_export(self.export.id)
+        self.assertEqual(claimed, self.attachment)
+        self.assertEqual(self.attachment.export_claim_id, self.export)
+        self.assertFalse(self.attachment._claim_for_export(other_export.id))
+
+        # nur der besitzende Export gibt den Anhang wieder frei
+        self.attachment._release_export_claims(other_export.ids)
+        self.assertTrue(self.attachment.is_exported)
+        self.attachment._release_export_claims(self.export.ids)
+        self.assertFalse(self.attachment.is_exported)
+        self.assertFalse(self.attachment.export_claim_id)
@@ -0,0 +1,174 @@
+from odoo.tests.common import TransactionCase
+import base64
+import io
+import os
+import tempfile
+import zipfile
+
+from ..controllers.attachment_controller import AttachmentDownloadController
+from ..tools.archive_cache import ArchiveCache
+
+
+class TestIrAttachmentDownload(TransactionCase):
+    def setUp(self):
+        super().setUp()
+
+        self.attachment = self.env['ir.attachment'].create({
+            'name': 'download.pdf',
+            'datas': base64.b64encode(b'Download').decode('utf-8'),
+            'datas_fname': 'download.pdf',
+            'res_model': 'res.country',
+            'res_id': 1,
+        })
+
+    def test_url_contains_token_only(self):
+        """Testet, ob die Download-URL nur das Token statt der IDs enthält"""
+        action = self.env['attachment.download'].with_context(
+            active_ids=self.attachment.ids).prepare_attachment()
+
+        download = self.env['attachment.download'].search([], order='id desc', limit=1)
+        self.assertEqual(
+            action['url'], '/web/attachment/download_zip/' + download.token)
+        self.assertEqual(download._get_downloadable_attachments(), self.attachment)
+
+    def test_domain_resolved_on_download(self):
+        """Testet, ob eine Domain erst beim Herunterladen ausgewertet wird"""
+        domain = [('res_model', '=', 'res.country'), ('name', 'like', 'download')]
+        self.env['attachment.download'].with_context(
+            active_domain=domain, download_all_results=True).prepare_attachment()
+        download = self.env['attachment.download'].search([], order='id desc', limit=1)
+
+        later = self.env['ir.attachment'].create({
+            'name': 'download_later.pdf',
+            'datas': base64.b64encode(b'Spaeter').decode('utf-8'),
+            'datas_fname': 'download_later.pdf',
+            'res_model': 'res.country',
+            'res_id': 2,
+        })
+        self.assertFalse(download.attachment_ids)
+        self.assertEqual(
+            download._get_downloadable_attachments(), self.attachment | later)
+
+    def test_selection_preferred_over_list_domain(self):
+        """Testet, ob ohne ausdrückliche Wahl nur die markierten Anhänge geladen werden"""
+        self.attachment.copy()
+        domain = [('res_model', '=', 'res.country'), ('name', 'like', 'download')]
+        self.env['attachment.download'].with_context(
+            active_ids=self.attachment.ids, active_domain=domain).prepare_attachment()
+        download = self.env['attachment.download'].search([], order='id desc', limit=1)
+
+        self.assertFalse(download.domain)
+        self.assertEqual(download._get_downloadable_attachments(), self.attachment)
+
+    def test_cache_key_changes_with_attachment(self):
+        """Testet, ob sich der Cache-Schlüssel bei geändertem Anhang ändert"""
+        controller = AttachmentDownloadController()
+        key = controller._get_cache_key(self.env, self.attachment.ids, 'zip')
+        self.assertEqual(
+            key, controller._get_cache_key(self.env, self.attachment.ids, 'zip'))
+        self.assertNotEqual(
+            key, controller._get_cache_key(self.env, self.attachment.ids, 'tar_gz'))
+
+        self.attachment.datas = base64.b64encode(b'Neuer Inhalt').decode('utf-8')
+        self.assertNotEqual(
+            key, controller._get_cache_key(self.env, self.attachment.ids, 'zip'))
+
+        # Archive werden nicht zwischen Benutzern mit anderen Rechten geteilt
+        user = self.env['res.users'].create({
+            'name': 'DMS Download',
+            'login': 'dms_download',
+            'groups_id': [(6, 0, [self.env.ref('base.group_user').id])],
+        })
+        self.assertNotEqual(
+            controller._get_cache_key(self.env, self.attachment.ids, 'zip'),
+            controller._get_cache_key(self.env(user=user.id), self.attachment.ids, 'zip'))
+
+    def test_archive_cache_evicts_least_recently_used(self):
+        """Testet, ob der Archiv-Cache zuerst das am längsten unbenutzte Archiv löscht"""
+        directory = tempfile.mkdtemp()
+        archive_cache = ArchiveCache(directory, 30)
+        for key in ['a', 'b', 'c']:
+            cache_file = archive_cache.open(key)
+            cache_file.write(b'x' * 10)
+            cache_file.commit()
+            # Zeitstempel der Archive unterscheidbar machen
+            os.utime(os.path.join(directory, key), (len(key), ord(key)))
+        os.utime(os.path.join(directory, 'a'), (1, 1000))
+
+        archive_cache.max_size = 25
+        archive_cache.evict()
+        self.assertEqual(sorted(os.listdir(directory)), ['a', 'c'])
+
+        # ein geöffnetes Archiv bleibt lesbar, auch wenn es entfernt wird
+        cached_file = archive_cache.get('c')
+        os.unlink(os.path.join(directory, 'c'))
+        with cached_file:
+            self.assertEqual(cached_file.read(), b'x' * 10)
+        self.assertIsNone(archive_cache.get('c'))
+
+    def test_archive_cached_after_client_disconnect(self):
+        """Testet, ob das Archiv nach einem Verbindungsabbruch fertig gepackt im Cache landet"""
+        params = self.env['ir.config_parameter'].sudo()
+        params.set_param('dms_attachment_manager.export_batch_size', '1')
+        params.set_param('dms_attachment_manager.download_cache_size', '10')
+        attachments = self.attachment + self.attachment.copy() + self.attachment.copy()
+
+        controller = AttachmentDownloadController()
+        cache_key = controller._get_cache_key(self.env, attachments.ids, 'zip')
+        archive_cache = controller._get_archive_cache(self.env)
+        # der Stream arbeitet mit einem eigenen Cursor auf der Testtransaktion
+        self.registry.enter_test_mode(self.cr)
+        try:
+            stream = controller._stream_zip(
+                self.cr.dbname, self.uid, attachments.ids, 'zip', cache_key)
+            next(stream)
+            stream.close()
+        finally:
+            self.registry.leave_test_mode()
+
+        cached_file = archive_cache.get(cache_key)
+        self.assertTrue(cached_file)
+        try:
+            with cached_file, zipfile.ZipFile(cached_file) as zip_file:
+                self.assertEqual(len(zip_file.namelist()), 4)
+        finally:
+            os.unlink(os.path.join(archive_cache.directory, cache_key))
+
+    def test_archive_bytes_repeatable(self):
+        """Testet, ob dieselbe Auswahl immer dieselben Archiv-Bytes ergibt"""
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET write_date = '2020-01-02 03:04:06' WHERE id = %s",
+            (self.attachment.id,))
+        self.attachment.invalidate_cache()
+        controller = AttachmentDownloadController()
+        archive_data = b''.join(
+            controller._iter_zip_stream(self.env, self.attachment.ids, 'zip'))
+        self.assertEqual(archive_data, b''.join(
+            controller._iter_zip_stream(self.env, self.attachment.ids, 'zip')))
+
+        with zipfile.ZipFile(io.BytesIO(archive_data)) as zip_file:
+            date_time = zip_file.getinfo('download.pdf').date_time
+        expected = self.env['ir.attachment.export']._get_entry_date_time(self.attachment)
+        self.assertEqual(date_time, expected)
+
+    def test_missing_and_url_attachments_skipped(self):
+        """Testet, ob gelöschte und URL-Anhänge im Archiv als übersprungen gelistet werden"""
+        deleted = self.attachment.copy()
+        deleted_id = deleted.id
+        deleted.unlink()
+        link = self.env['ir.attachment'].create({
+            'name': 'link',
+            'type': 'url',
+            'url': 'https://example.com',
+        })
+
+        controller = AttachmentDownloadController()
+        archive_data = b''.join(controller._iter_zip_stream(
+            self.env, [self.attachment.id, deleted_id, link.id], 'zip'))
+        with zipfile.ZipFile(io.BytesIO(archive_data)) as zip_file:
+            self.assertIn('download.pdf', zip_file.namelist())
+            skipped = zip_file.read('_skipped.csv').decode('utf-8').splitlines()
+        self.assertEqual(skipped[1:], [
+            '{};missing'.format(deleted_id),
+            '{};not a file'.format(link.id),
+        ])
@@ -1,8 +1,14 @@
 from odoo.tests.common import TransactionCase
 from datetime import date, timedelta
 import base64
+import hashlib
+import tarfile
 import zipfile
 import io
+import os
+from unittest.mock import patch
+
+from ..models.ir_attachment_export_part import JOB_LOCK_KEY
 
 
 class TestIrAttachmentExportZip(TransactionCase):
@@ -83,3 +89,292 @@ class TestIrAttachmentExportZip(TransactionCase):
             self.assertIn(self.attachment.datas_fname, zip_filenames)
             extracted_content = zip_file.read(self.attachment.datas_fname)
             self.assertEqual(extracted_content, b'Testinhalt')
+
+    def test_zip_registered_from_file(self):
+        """Testet, ob das ZIP-Archiv mit Größe und Prüfsumme registriert wird"""
+        self.export.action_check_attachments()
+        self.export.pack_zip()
+
+        zip_attachment = self.env['ir.attachment'].search([
+            ('res_model', '=', 'ir.attachment.export'),
+            ('res_id', '=', self.export.id),
+            ('mimetype', '=', 'application/zip')
+        ], limit=1)
+
+        zip_data = base64.b64decode(zip_attachment.datas)
+        self.assertEqual(zip_attachment.file_size, len(zip_data))
+        # beim Schreiben berechnete Prüfsumme entspricht dem Inhalt
+        self.assertEqual(zip_attachment.checksum, hashlib.sha1(zip_data).hexdigest())
+
+    def test_async_job_progress(self):
+        """Testet, ob der Hintergrund-Export den Fortschritt protokolliert"""
+        self.export.action_check_attachments()
+        self.export.action_pack_zip_async()
+        self.assertEqual(self.export.state, 'queued')
+        self.assertEqual(self.export.progress_files_total, 1)
+
+        self.env['ir.attachment.export']._cron_process_export_queue()
+        self.assertEqual(self.export.state, 'done')
+        self.assertEqual(self.export.progress_files_done, 1)
+        self.assertEqual(self.export.progress_percent, 100.0)
+
+    def test_cron_skips_locked_part(self):
+        """Testet, ob der Cron einen Teil auslässt, den ein anderer Lauf packt"""
+        self.export.action_check_attachments()
+        self.export.action_pack_zip_async()
+        part = self.export.part_ids
+
+        # der andere Lauf hält die Sperre in einer eigenen Datenbanksitzung
+        with self.registry.cursor() as job_cr:
+            job_cr.execute('SELECT pg_advisory_lock(%s, %s)', (JOB_LOCK_KEY, part.id))
+            self.env['ir.attachment.export']._cron_process_export_queue()
+            self.assertEqual(part.state, 'queued')
+            job_cr.execute('SELECT pg_advisory_unlock(%s, %s)', (JOB_LOCK_KEY, part.id))
+
+        self.env['ir.attachment.export']._cron_process_export_queue()
+        self.assertEqual(part.state, 'done')
+        self.assertEqual(self.export.state, 'done')
+
+    def test_cron_packs_tar_in_slices(self):
+        """Testet, ob der Cron ein tar.gz-Archiv über mehrere Läufe fortsetzt"""
+        params = self.env['ir.config_parameter'].sudo()
+        params.set_param('dms_attachment_manager.export_batch_size', '1')
+        params.set_param('dms_attachment_manager.export_cron_batches', '1')
+        self.attachment.copy({'name': 'zweite.pdf', 'datas_fname': 'zweite.pdf'})
+        self.export.archive_format = 'tar_gz'
+        self.export.action_check_attachments()
+        self.export.action_pack_zip_async()
+        part = self.export.part_ids
+
+        self.env['ir.attachment.export']._cron_process_export_queue()
+        self.assertEqual(part.state, 'running')
+        self.assertEqual(part.checkpoint_files, 1)
+
+        self.env['ir.attachment.export']._cron_process_export_queue()
+        self.assertEqual(part.state, 'done')
+        tar_data = base64.b64decode(part.archive_id.datas)
+        with tarfile.open(fileobj=io.BytesIO(tar_data), mode='r:gz') as tar_file:
+            self.assertEqual(
+                sorted(tar_file.getnames()), ['_manifest.csv', 'test.pdf', 'zweite.pdf'])
+            self.assertEqual(tar_file.extractfile('test.pdf').read(), b'Testinhalt')
+
+    def test_compression_policy(self):
+        """Testet, ob bereits komprimierte Formate ohne Deflate gespeichert werden"""
+        self.assertEqual(self.export._get_compression(self.attachment, b'')[0], 0)
+
+        self.export.compression_policy = 'deflate'
+        self.assertEqual(self.export._get_compression(self.attachment, b'')[0], 8)
+
+        self.export.compression_policy = 'probe'
+        sample = b'a' * 1024
+        self.assertEqual(self.export._get_compression(self.attachment, sample)[0], 8)
+
+    def test_zip_parallel_workers(self):
+        """Testet, ob das ZIP-Archiv mit mehreren Pack-Workern identisch befüllt wird"""
+        self.env['ir.config_parameter'].sudo().set_param(
+            'dms_attachment_manager.pack_workers', '4')
+        self.export.action_check_attachments()
+        self.export.pack_zip()
+
+        zip_attachment = self.env['ir.attachment'].search([
+            ('res_model', '=', 'ir.attachment.export'),
+            ('res_id', '=', self.export.id),
+            ('mimetype', '=', 'application/zip')
+        ], limit=1)
+
+        zip_data = base64.b64decode(zip_attachment.datas)
+        with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_file:
+            self.assertEqual(zip_file.read(self.attachment.datas_fname), b'Testinhalt')
+
+    def test_zip_split_into_parts(self):
+        """Testet, ob ein Export mit Größenlimit auf mehrere Archive verteilt wird"""
+        model = self.env['ir.model'].search([('model', '=', 'res.country')], limit=1)
+        for index in range(2):
+            self.env['ir.attachment'].create({
+                'name': 'scan{}.txt'.format(index),
+                'datas': base64.b64encode(b'x' * 700 * 1024).decode('utf-8'),
+                'datas_fname': 'scan{}.txt'.format(index),
+                'res_model': model.model,
+                'res_id': 1,
+            })
+        self.export.max_part_size = 1
+        self.export.action_check_attachments()
+        self.export.pack_zip()
+
+        self.assertEqual(self.export.state, 'done')
+        self.assertEqual(len(self.export.part_ids), 2)
+        self.assertTrue(self.export.part_ids[0].name.endswith('_part01.zip'))
+        self.assertTrue(all(self.export.part_ids.mapped('archive_id')))
+
+    def test_total_size_aggregated(self):
+        """Testet, ob Anzahl und Gesamtgröße der Anhänge gespeichert werden"""
+        self.export.action_check_attachments()
+        self.assertEqual(self.export.attachment_count, len(self.export.attachment_ids))
+        self.assertEqual(
+            self.export.total_attachment_bytes,
+            sum(self.export.attachment_ids.mapped('file_size')))
+
+    def test_model_stats_cached(self):
+        """Testet, ob die Modellliste aus der Statistik-Tabelle gelesen wird"""
+        self.env['ir.attachment.model.stat']._refresh()
+        stats = self.env['ir.attachment.model.stat']._get_stats()
+        self.assertIn('res.country', stats)
+        self.assertGreaterEqual(stats['res.country'].attachment_count, 1)
+        self.assertIn('res.country', self.export._get_models())
+
+    def test_models_without_stats(self):
+        """Testet, ob die Modellliste ohne Statistik aus den Anhängen gelesen wird"""
+        self.env['ir.attachment.model.stat'].search([]).unlink()
+        self.assertIn('res.country', self.export._get_models())
+
+    def test_resume_from_checkpoint(self):
+        """Testet, ob ein unterbrochener Pack-Job am Checkpoint fortgesetzt wird"""
+        self.env['ir.config_parameter'].sudo().set_param(
+            'dms_attachment_manager.export_batch_size', '1')
+        model = self.env['ir.model'].search([('model', '=', 'res.country')], limit=1)
+        self.env['ir.attachment'].create({
+            'name': 'test.pdf',
+            'datas': base64.b64encode(b'Zweiter Inhalt').decode('utf-8'),
+            'datas_fname': 'test.pdf',
+            'res_model': model.model,
+            'res_id': 1,
+        })
+        self.export.action_check_attachments()
+        part = self.export._plan_parts()
+
+        # erster Lauf endet nach dem ersten Batch
+        part._run_pack_job(max_batches=1)
+        self.assertEqual(part.state, 'running')
+        self.assertEqual(part.checkpoint_files, 1)
+        self.assertEqual(part.checkpoint_entries, 1)
+
+        part._run_pack_job()
+        self.assertEqual(part.state, 'done')
+        self.assertFalse(part.checkpoint_path)
+
+        zip_data = base64.b64decode(part.archive_id.datas)
+        with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_file:
+            self.assertEqual(
+                sorted(zip_file.namelist()),
+                ['_manifest.csv', 'test (1).pdf', 'test.pdf'])
+            self.assertIsNone(zip_file.testzip())
+
+    def test_unlink_removes_checkpoint_files(self):
+        """Testet, ob beim Löschen des Exports die Checkpoint-Dateien entfernt werden"""
+        self.export.action_check_attachments()
+        part = self.export._plan_parts()
+        archive_file, __ = part._open_checkpoint()
+        archive_file.close()
+        path = part.checkpoint_path
+        self.assertTrue(os.path.isfile(path))
+
+        self.export.unlink()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + '.journal'))
+
+    def test_zip_deduplicates_content(self):
+        """Testet, ob Anhänge mit gleichem Inhalt nur einmal gespeichert werden"""
+        model = self.env['ir.model'].search([('model', '=', 'res.country')], limit=1)
+        self.env['ir.attachment'].create({
+            'name': 'copy.pdf',
+            'datas': base64.b64encode(b'Testinhalt').decode('utf-8'),
+            'datas_fname': 'copy.pdf',
+            'res_model': model.model,
+            'res_id': 2,
+        })
+        self.export.deduplicate = True
+        self.export.action_check_attachments()
+        self.export.pack_zip()
+
+        zip_data = base64.b64decode(self.export.part_ids.archive_id.datas)
+        with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_file:
+            names = zip_file.namelist()
+            self.assertEqual(len(names), 3)
+            self.assertIn('_duplicates.csv', names)
+            # neuere Kopie wird zuerst gespeichert, das Original verweist darauf
+            self.assertIn(b'test.pdf;copy.pdf;', zip_file.read('_duplicates.csv'))
+
+    def test_zip_names_unique_ignoring_case(self):
+        """Testet, ob Dateinamen im ZIP auch ohne Groß-/Kleinschreibung eindeutig sind"""
+        model = self.env['ir.model'].search([('model', '=', 'res.country')], limit=1)
+        for index, name in enumerate(['Test.pdf', 'test (1).pdf']):
+            self.env['ir.attachment'].create({
+                'name': name,
+                'datas': base64.b64encode(name.encode('utf-8')).decode('utf-8'),
+                'datas_fname': name,
+                'res_model': model.model,
+                'res_id': index + 2,
+            })
+        self.export.action_check_attachments()
+        self.export.pack_zip()
+
+        zip_data = base64.b64decode(self.export.part_ids.archive_id.datas)
+        with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_file:
+            names = [name.lower() for name in zip_file.namelist()]
+            self.assertEqual(len(names), 4)
+            self.assertEqual(len(set(names)), 4)
+
+    def test_stages_recorded(self):
+        """Testet, ob Dauer und Volumen jeder Exportphase gespeichert werden"""
+        self.export.action_check_attachments()
+        self.export.pack_zip()
+
+        stages = {stage.name: stage for stage in self.export.stage_ids}
+        self.assertEqual(set(stages), {'search', 'flag', 'pack', 'store'})
+        self.assertEqual(stages['search'].files, 1)
+        self.assertEqual(stages['pack'].bytes_read, 10)
+        self.assertGreater(stages['pack'].bytes_written, 0)
+        self.assertGreater(stages['flag'].query_count, 0)
+
+    def test_pack_tar_gz(self):
+        """Testet, ob der Export als tar.gz-Archiv gepackt werden kann"""
+        self.export.archive_format = 'tar_gz'
+        self.export.action_check_attachments()
+        self.export.pack_zip()
+
+        archive = self.export.part_ids.archive_id
+        self.assertTrue(archive.name.endswith('.tar.gz'))
+        self.assertEqual(archive.mimetype, 'application/gzip')
+        tar_data = base64.b64decode(archive.datas)
+        with tarfile.open(fileobj=io.BytesIO(tar_data), mode='r:gz') as tar_file:
+            self.assertEqual(tar_file.getnames(), ['test.pdf', '_manifest.csv'])
+            self.assertEqual(tar_file.extractfile('test.pdf').read(), b'Testinhalt')
+
+    def test_async_job_progress_tar(self):
+        """Testet, ob der Hintergrund-Export als tar.gz den Fortschritt protokolliert"""
+        self.export.archive_format = 'tar_gz'
+        self.export.action_check_attachments()
+        self.export.action_pack_zip_async()
+
+        self.env['ir.attachment.export']._cron_process_export_queue()
+        part = self.export.part_ids
+        self.assertEqual(part.state, 'done')
+        self.assertEqual(part.progress_files_done, 1)
+        self.assertEqual(part.progress_bytes_done, part.bytes_total)
+        self.assertEqual(self.export.progress_percent, 100.0)
+
+    def test_sync_pack_does_not_commit(self):
+        """Testet, ob das direkte Packen den Fortschritt schreibt, ohne zu committen"""
+        self.export.archive_format = 'tar_gz'
+        self.export.action_check_attachments()
+        with patch.object(type(self.export), '_commit_progress') as commit_progress:
+            self.export.pack_zip()
+        commit_progress.assert_not_called()
+        self.assertEqual(self.export.part_ids.progress_files_done, 1)
+
+    def test_zip_contains_manifest(self):
+        """Testet, ob das Manifest Herkunft, Größe und Position jeder Datei enthält"""
+        self.export.action_check_attachments()
+        self.export.pack_zip()
+
+        zip_data = base64.b64decode(self.export.part_ids.archive_id.datas)
+        with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_file:
+            manifest = zip_file.read('_manifest.csv').decode('utf-8').splitlines()
+            info = zip_file.getinfo('test.pdf')
+
+        self.assertEqual(
+            manifest[0], 'attachment_id;res_model;res_id;file;size;checksum;offset')
+        self.assertEqual(manifest[1], ';'.join(map(str, [
+            self.attachment.id, 'res.country', 1, 'test.pdf', 10,
+            self.attachment.checksum, info.header_offset,
+        ])))
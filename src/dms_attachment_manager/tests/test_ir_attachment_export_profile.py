@@ -0,0 +1,45 @@
+from odoo.tests.common import TransactionCase
+import base64
+
+
+class TestIrAttachmentExportProfile(TransactionCase):
+    def setUp(self):
+        super().setUp()
+        model = self.env['ir.model'].search([('model', '=', 'res.country')], limit=1)
+
+        self.attachment = self.env['ir.attachment'].create({
+            'name': 'delta.pdf',
+            'datas': base64.b64encode(b'Delta').decode('utf-8'),
+            'datas_fname': 'delta.pdf',
+            'res_model': model.model,
+            'res_id': 1,
+        })
+        # älter als die Sicherheitsfrist des Delta-Exports
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET create_date = '2000-01-01' WHERE id = %s",
+            (self.attachment.id,))
+        self.attachment.invalidate_cache()
+
+        self.profile = self.env['ir.attachment.export.profile'].create({
+            'name': 'Delta',
+            'model_ids': [(6, 0, [model.id])],
+            'last_attachment_id': self.attachment.id - 1,
+        })
+
+    def test_delta_export_moves_high_water_mark(self):
+        """Testet, ob nur neue Anhänge exportiert und die Marke verschoben wird"""
+        export = self.profile._run_delta_export()
+        self.assertEqual(export.attachment_ids, self.attachment)
+        self.assertEqual(export.state, 'queued')
+        self.assertEqual(self.profile.last_attachment_id, self.attachment.id)
+        self.assertFalse(self.attachment.is_exported)
+
+        # zweiter Lauf ohne neue Anhänge
+        self.assertFalse(self.profile._run_delta_export())
+
+    def test_delta_export_waits_for_recent_attachments(self):
+        """Testet, ob frische Anhänge die Marke erst nach der Sicherheitsfrist passieren"""
+        recent = self.attachment.copy()
+        export = self.profile._run_delta_export()
+        self.assertEqual(export.attachment_ids, self.attachment)
+        self.assertLess(self.profile.last_attachment_id, recent.id)
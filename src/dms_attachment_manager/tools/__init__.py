@@ -0,0 +1 @@
+from . import archive_cache, archive_writer, name_allocator, tar_stream, zip_stream
\ No newline at end of file
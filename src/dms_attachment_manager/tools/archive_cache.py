@@ -0,0 +1,90 @@
+import os
+import tempfile
+
+
+class ArchiveCacheFile(object):
+    """Archive being written to the cache under a temporary name.
+
+    The archive only becomes visible to :meth:`ArchiveCache.get` when it is
+    committed, so a partially written archive is never served.
+    """
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._key = key
+        fd, self._temp_path = tempfile.mkstemp(prefix=".", dir=cache.directory)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        os.rename(self._temp_path, self._cache._path(self._key))
+        self._temp_path = None
+        self._cache.evict()
+
+    def discard(self):
+        if self._temp_path:
+            self._file.close()
+            os.unlink(self._temp_path)
+            self._temp_path = None
+
+
+class ArchiveCache(object):
+    """Archives on local disk, keyed by the caller.
+
+    Once the archives exceed ``max_size`` bytes, the least recently used ones
+    are removed. Reading an archive through :meth:`get` counts as a use.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return the archive cached under ``key`` opened for reading, or None.
+
+        The open file stays readable when the archive is evicted meanwhile.
+        """
+        path = self._path(key)
+        try:
+            archive_file = open(path, "rb")
+        except (IOError, OSError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return archive_file
+
+    def open(self, key):
+        return ArchiveCacheFile(self, key)
+
+    def evict(self):
+        archives = []
+        for name in os.listdir(self.directory):
+            # archives still being written start with a dot
+            if name.startswith("."):
+                continue
+            path = self._path(name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            archives.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for __, size, __ in archives)
+        for __, size, path in sorted(archives):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total_size -= size
@@ -0,0 +1,53 @@
+from .tar_stream import (
+    GzipCompressor,
+    TarEntry,
+    TarStreamWriter,
+    ZstdCompressor,
+    zstandard,
+)
+from .zip_stream import DEFAULT_LEVEL, ZipEntry, ZipStreamWriter
+
+ARCHIVE_FORMATS = [
+    ("zip", "ZIP"),
+    ("tar_gz", "TAR (gzip)"),
+    ("tar_zst", "TAR (Zstandard)"),
+]
+ARCHIVE_EXTENSIONS = {"zip": ".zip", "tar_gz": ".tar.gz", "tar_zst": ".tar.zst"}
+ARCHIVE_MIMETYPES = {
+    "zip": "application/zip",
+    "tar_gz": "application/gzip",
+    "tar_zst": "application/zstd",
+}
+
+
+def is_format_available(archive_format):
+    return archive_format != "tar_zst" or zstandard is not None
+
+
+def new_archive_writer(
+    archive_format, fileobj, level=DEFAULT_LEVEL, threads=0, offset=0, entries=None
+):
+    """Return a streaming writer for ``archive_format`` writing to ``fileobj``.
+
+    All writers offer ``open_entry``, ``write_entry``, ``checkpoint``,
+    ``close`` and the ``offset`` and ``entries`` attributes of
+    :class:`ZipStreamWriter`. ZIP entries are compressed one by one, tar
+    archives as a whole stream. ``offset`` and ``entries`` continue an
+    archive written up to a checkpoint.
+    """
+    if archive_format == "tar_gz":
+        return TarStreamWriter(
+            fileobj, lambda: GzipCompressor(level), offset, entries
+        )
+    if archive_format == "tar_zst":
+        return TarStreamWriter(
+            fileobj, lambda: ZstdCompressor(level, threads), offset, entries
+        )
+    return ZipStreamWriter(fileobj, offset, entries)
+
+
+def archive_entry_from_dict(archive_format, values):
+    """Return the entry of ``archive_format`` saved with ``to_dict``."""
+    if archive_format == "zip":
+        return ZipEntry.from_dict(values)
+    return TarEntry.from_dict(values)
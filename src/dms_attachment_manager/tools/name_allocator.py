@@ -0,0 +1,35 @@
+def split_extension(name):
+    if "." in name:
+        base_name, extension = name.rsplit(".", 1)
+        return base_name, "." + extension
+    return name, ""
+
+
+class UniqueNameAllocator(object):
+    """Hand out file names that are unique within an archive.
+
+    Names are compared case-insensitively, so ``Scan.pdf`` and ``scan.pdf``
+    do not overwrite each other when extracted on Windows or macOS. The taken
+    names live in a set and the next free counter is remembered per name, so
+    allocating n names takes linear time even if all of them collide.
+    """
+
+    def __init__(self, names=()):
+        self._taken = {name.lower() for name in names}
+        self._counters = {}
+
+    def allocate(self, name):
+        key = name.lower()
+        if key not in self._taken:
+            self._taken.add(key)
+            return name
+
+        base_name, extension = split_extension(name)
+        counter = self._counters.get(key, 1)
+        new_name = "{} ({}){}".format(base_name, counter, extension)
+        while new_name.lower() in self._taken:
+            counter += 1
+            new_name = "{} ({}){}".format(base_name, counter, extension)
+        self._counters[key] = counter + 1
+        self._taken.add(new_name.lower())
+        return new_name
@@ -0,0 +1,175 @@
+import tarfile
+import tempfile
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .zip_stream import COPY_CHUNK_SIZE, DEFAULT_LEVEL, SPOOL_SIZE
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+RECORD_SIZE = tarfile.RECORDSIZE
+
+
+class GzipCompressor(object):
+    def __init__(self, level=DEFAULT_LEVEL):
+        # wbits 31 writes the gzip header and trailer around the deflate data
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class ZstdCompressor(object):
+    """Zstandard compression, on ``threads`` worker threads if more than one."""
+
+    def __init__(self, level=DEFAULT_LEVEL, threads=0):
+        if zstandard is None:
+            raise RuntimeError("The python package zstandard is not installed.")
+        self._compressor = zstandard.ZstdCompressor(
+            level=level, threads=threads if threads > 1 else 0
+        ).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class TarEntry(object):
+    """Name, size and position of an entry in the uncompressed tar stream."""
+
+    def __init__(self, name, offset, file_size):
+        self.name = name
+        self.offset = offset
+        self.file_size = file_size
+
+    @property
+    def end_offset(self):
+        """Position after the data of the entry and its block padding."""
+        return self.offset - (-self.file_size // BLOCK_SIZE) * BLOCK_SIZE
+
+    def to_dict(self):
+        return {"name": self.name, "offset": self.offset, "file_size": self.file_size}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values["name"], values["offset"], values["file_size"])
+
+
+class TarEntryWriter(object):
+    """File-like writer for the data of a single tar entry.
+
+    The tar header holds the size of the data, so the data is spooled until
+    the entry is closed, in memory up to ``spool_size`` and on disk above.
+    """
+
+    def __init__(self, archive, name, date_time, spool_size=SPOOL_SIZE):
+        self._archive = archive
+        self._name = name
+        self._date_time = date_time
+        self._data = tempfile.SpooledTemporaryFile(max_size=spool_size)
+
+    def write(self, data):
+        self._data.write(data)
+
+    def close(self):
+        try:
+            size = self._data.tell()
+            self._data.seek(0)
+            self._archive._write_member(
+                self._name,
+                size,
+                self._date_time,
+                iter(lambda: self._data.read(COPY_CHUNK_SIZE), b""),
+            )
+        finally:
+            self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._data.close()
+
+
+class TarStreamWriter(object):
+    """Write a compressed tar archive to a file-like object, entry by entry.
+
+    Offers the entry interface of :class:`ZipStreamWriter`; the per-entry
+    compression arguments are ignored because the whole stream is compressed
+    by compressors returned by ``new_compressor``. ``offset`` counts the
+    compressed bytes written. ``offset`` and ``entries`` continue an archive
+    written up to a :meth:`checkpoint`, e.g. when a packing job is resumed.
+    """
+
+    def __init__(self, fileobj, new_compressor, offset=0, entries=None):
+        self.fileobj = fileobj
+        self._new_compressor = new_compressor
+        self._compressor = None
+        self.offset = offset
+        self.entries = list(entries or [])
+        self._tar_offset = self.entries[-1].end_offset if self.entries else 0
+
+    def _write(self, data):
+        if self._compressor is None:
+            self._compressor = self._new_compressor()
+        self._tar_offset += len(data)
+        data = self._compressor.compress(data)
+        if data:
+            self.fileobj.write(data)
+            self.offset += len(data)
+
+    def checkpoint(self):
+        """Finish the compressed member, so the archive up to ``offset`` can
+        be continued with a new member after a restart.
+
+        gzip and zstd read concatenated members as one stream.
+        """
+        if self._compressor is not None:
+            data = self._compressor.flush()
+            self.fileobj.write(data)
+            self.offset += len(data)
+            self._compressor = None
+
+    def _write_member(self, name, size, date_time, chunks):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        if date_time:
+            info.mtime = int(time.mktime(tuple(date_time) + (0, 0, -1)))
+        else:
+            info.mtime = int(time.time())
+        # PAX headers keep long names, non-ASCII names and sizes over 8 GB
+        self._write(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+        self.entries.append(TarEntry(name, self._tar_offset, size))
+        for chunk in chunks:
+            self._write(chunk)
+        remainder = size % BLOCK_SIZE
+        if remainder:
+            self._write(b"\0" * (BLOCK_SIZE - remainder))
+
+    def open_entry(self, name, date_time=None, **kwargs):
+        return TarEntryWriter(self, name, date_time)
+
+    def write_entry(self, name, chunks, **kwargs):
+        with self.open_entry(name, **kwargs) as entry_writer:
+            for chunk in chunks:
+                entry_writer.write(chunk)
+
+    def close(self):
+        self._write(b"\0" * (2 * BLOCK_SIZE))
+        remainder = self._tar_offset % RECORD_SIZE
+        if remainder:
+            self._write(b"\0" * (RECORD_SIZE - remainder))
+        self.checkpoint()
@@ -0,0 +1,403 @@
+import hashlib
+import struct
+import tempfile
+import time
+import zlib
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+DEFAULT_LEVEL = 6
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+# zipfile switches to ZIP64 below the hard limit, deflate may grow the data
+ZIP64_THRESHOLD = int(ZIP64_LIMIT / 1.05)
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+LOCAL_HEADER_SIGNATURE = 0x04034B50
+DATA_DESCRIPTOR = struct.Struct("<IIII")
+DATA_DESCRIPTOR64 = struct.Struct("<IIQQ")
+DATA_DESCRIPTOR_SIGNATURE = 0x08074B50
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+CENTRAL_HEADER_SIGNATURE = 0x02014B50
+END_RECORD = struct.Struct("<IHHHHIIH")
+END_RECORD_SIGNATURE = 0x06054B50
+END_RECORD64 = struct.Struct("<IQHHIIQQQQ")
+END_RECORD64_SIGNATURE = 0x06064B50
+END_LOCATOR64 = struct.Struct("<IIQI")
+END_LOCATOR64_SIGNATURE = 0x07064B50
+
+COPY_CHUNK_SIZE = 1024 * 1024
+SPOOL_SIZE = 8 * 1024 * 1024
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+UNIX_FILE_ATTRIBUTES = 0o100644 << 16
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    dos_date = (max(year, 1980) - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_date, dos_time
+
+
+class ZipEntry(object):
+    """Central directory information of an entry written to the archive."""
+
+    def __init__(self, name, offset, compress_type, date_time):
+        self.name = name
+        self.offset = offset
+        self.compress_type = compress_type
+        self.date_time = tuple(date_time)
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.zip64 = False
+        try:
+            self.encoded_name = name.encode("ascii")
+            self.flags = FLAG_DATA_DESCRIPTOR
+        except UnicodeEncodeError:
+            self.encoded_name = name.encode("utf-8")
+            self.flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "offset": self.offset,
+            "compress_type": self.compress_type,
+            "date_time": list(self.date_time),
+            "crc": self.crc,
+            "file_size": self.file_size,
+            "compress_size": self.compress_size,
+            "zip64": self.zip64,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        entry = cls(
+            values["name"],
+            values["offset"],
+            values["compress_type"],
+            values["date_time"],
+        )
+        entry.crc = values["crc"]
+        entry.file_size = values["file_size"]
+        entry.compress_size = values["compress_size"]
+        entry.zip64 = values["zip64"]
+        return entry
+
+    @property
+    def version(self):
+        if self.zip64:
+            return 45
+        return 20 if self.compress_type == ZIP_DEFLATED else 10
+
+    def local_header(self):
+        dos_date, dos_time = _dos_date_time(self.date_time)
+        extra = b""
+        size = 0
+        if self.zip64:
+            # real sizes follow in the data descriptor
+            extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+            size = ZIP64_LIMIT
+        header = LOCAL_HEADER.pack(
+            LOCAL_HEADER_SIGNATURE,
+            self.version,
+            self.flags,
+            self.compress_type,
+            dos_time,
+            dos_date,
+            0,
+            size,
+            size,
+            len(self.encoded_name),
+            len(extra),
+        )
+        return header + self.encoded_name + extra
+
+    def data_descriptor(self):
+        if self.zip64:
+            return DATA_DESCRIPTOR64.pack(
+                DATA_DESCRIPTOR_SIGNATURE,
+                self.crc,
+                self.compress_size,
+                self.file_size,
+            )
+        return DATA_DESCRIPTOR.pack(
+            DATA_DESCRIPTOR_SIGNATURE, self.crc, self.compress_size, self.file_size
+        )
+
+    def central_header(self):
+        dos_date, dos_time = _dos_date_time(self.date_time)
+        extra_values = []
+        file_size, compress_size, offset = (
+            self.file_size,
+            self.compress_size,
+            self.offset,
+        )
+        if file_size >= ZIP64_LIMIT:
+            extra_values.append(file_size)
+            file_size = ZIP64_LIMIT
+        if compress_size >= ZIP64_LIMIT:
+            extra_values.append(compress_size)
+            compress_size = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            extra_values.append(offset)
+            offset = ZIP64_LIMIT
+        extra = b""
+        version = self.version
+        if extra_values:
+            extra = struct.pack(
+                "<HH{}Q".format(len(extra_values)),
+                1,
+                8 * len(extra_values),
+                *extra_values
+            )
+            version = 45
+        header = CENTRAL_HEADER.pack(
+            CENTRAL_HEADER_SIGNATURE,
+            3 << 8 | version,
+            version,
+            self.flags,
+            self.compress_type,
+            dos_time,
+            dos_date,
+            self.crc,
+            compress_size,
+            file_size,
+            len(self.encoded_name),
+            len(extra),
+            0,
+            0,
+            0,
+            UNIX_FILE_ATTRIBUTES,
+            offset,
+        )
+        return header + self.encoded_name + extra
+
+
+class ZipEntryWriter(object):
+    """File-like writer for the data of a single entry."""
+
+    def __init__(self, archive, entry, level):
+        self._archive = archive
+        self._entry = entry
+        self._compressor = None
+        if entry.compress_type == ZIP_DEFLATED:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    def write(self, data):
+        entry = self._entry
+        entry.crc = zlib.crc32(data, entry.crc)
+        entry.file_size += len(data)
+        if self._compressor:
+            data = self._compressor.compress(data)
+        if data:
+            entry.compress_size += len(data)
+            self._archive._write(data)
+
+    def close(self):
+        entry = self._entry
+        if self._compressor:
+            data = self._compressor.flush()
+            entry.compress_size += len(data)
+            self._archive._write(data)
+            self._compressor = None
+        if entry.file_size >= ZIP64_LIMIT or entry.compress_size >= ZIP64_LIMIT:
+            if not entry.zip64:
+                raise ValueError(
+                    "Entry {} exceeds 4 GB without a ZIP64 size hint".format(
+                        entry.name
+                    )
+                )
+        self._archive._write(entry.data_descriptor())
+        self._archive.entries.append(entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class CompressedData(object):
+    """Entry data compressed ahead of writing, e.g. by a worker thread.
+
+    The compressed bytes are spooled to a temporary file once they exceed
+    ``spool_size``, so large files do not pile up in memory.
+    """
+
+    def __init__(self, compress_type, level=DEFAULT_LEVEL, spool_size=SPOOL_SIZE):
+        self.compress_type = compress_type
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.data = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self._compressor = None
+        if compress_type == ZIP_DEFLATED:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.file_size += len(data)
+        if self._compressor:
+            data = self._compressor.compress(data)
+        if data:
+            self.compress_size += len(data)
+            self.data.write(data)
+
+    def finish(self):
+        if self._compressor:
+            data = self._compressor.flush()
+            self.compress_size += len(data)
+            self.data.write(data)
+            self._compressor = None
+        self.data.seek(0)
+        return self
+
+    def close(self):
+        self.data.close()
+
+
+class ZipStreamWriter(object):
+    """Write a ZIP archive front to back without ever seeking.
+
+    CRC and sizes of each entry follow its data in a data descriptor, so the
+    archive can be sent to a socket or pipe while the files are still being
+    read and nothing but the central directory records is kept in memory.
+
+    ``offset`` and ``entries`` continue an archive whose entries were already
+    written to ``fileobj``, e.g. when a packing job is resumed.
+    """
+
+    def __init__(self, fileobj, offset=0, entries=None):
+        self.fileobj = fileobj
+        self.offset = offset
+        self.entries = list(entries or [])
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def open_entry(
+        self,
+        name,
+        compress_type=ZIP_DEFLATED,
+        level=DEFAULT_LEVEL,
+        date_time=None,
+        size_hint=0,
+    ):
+        entry = ZipEntry(
+            name, self.offset, compress_type, date_time or time.localtime()[:6]
+        )
+        entry.zip64 = size_hint >= ZIP64_THRESHOLD
+        self._write(entry.local_header())
+        return ZipEntryWriter(self, entry, level)
+
+    def iter_compressed_entry(self, name, compressed, date_time=None):
+        """Write an entry from :class:`CompressedData`.
+
+        Yields after every chunk copied, so a streaming caller can drain its
+        buffer in between.
+        """
+        entry = ZipEntry(
+            name,
+            self.offset,
+            compressed.compress_type,
+            date_time or time.localtime()[:6],
+        )
+        entry.crc = compressed.crc
+        entry.file_size = compressed.file_size
+        entry.compress_size = compressed.compress_size
+        entry.zip64 = max(entry.file_size, entry.compress_size) >= ZIP64_THRESHOLD
+        self._write(entry.local_header())
+        for chunk in iter(lambda: compressed.data.read(COPY_CHUNK_SIZE), b""):
+            self._write(chunk)
+            yield
+        self._write(entry.data_descriptor())
+        self.entries.append(entry)
+
+    def write_entry(self, name, chunks, **kwargs):
+        with self.open_entry(name, **kwargs) as entry_writer:
+            for chunk in chunks:
+                entry_writer.write(chunk)
+
+    def checkpoint(self):
+        """Nothing to finish, every entry ends complete at ``offset``."""
+
+    def close(self):
+        start = self.offset
+        for entry in self.entries:
+            self._write(entry.central_header())
+        size = self.offset - start
+        count = len(self.entries)
+        if count >= ZIP64_COUNT_LIMIT or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            end64_offset = self.offset
+            self._write(
+                END_RECORD64.pack(
+                    END_RECORD64_SIGNATURE,
+                    END_RECORD64.size - 12,
+                    45,
+                    45,
+                    0,
+                    0,
+                    count,
+                    count,
+                    size,
+                    start,
+                )
+            )
+            self._write(
+                END_LOCATOR64.pack(END_LOCATOR64_SIGNATURE, 0, end64_offset, 1)
+            )
+            count = min(count, ZIP64_COUNT_LIMIT)
+            size = min(size, ZIP64_LIMIT)
+            start = min(start, ZIP64_LIMIT)
+        self._write(
+            END_RECORD.pack(END_RECORD_SIGNATURE, 0, 0, count, count, size, start, 0)
+        )
+
+
+class StreamBuffer(object):
+    """Write target collecting the archive data until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class HashingFile(object):
+    """Write target computing the SHA-1 of everything written through it.
+
+    ``checksum`` continues a hash over data already in the file, e.g. the
+    part of a partial archive kept when a packing job is resumed.
+    """
+
+    def __init__(self, fileobj, checksum=None):
+        self.fileobj = fileobj
+        self.checksum = checksum or hashlib.sha1()
+
+    def write(self, data):
+        self.checksum.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        self.fileobj.close()
+
+    def hexdigest(self):
+        return self.checksum.hexdigest()